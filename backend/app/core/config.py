@@ -4,5 +4,7 @@ from pydantic import BaseModel
 class Settings(BaseModel):
     COLAB_API_BASE: str = os.getenv("COLAB_API_BASE", "").rstrip("/")
     COLAB_SHARED_SECRET: str = os.getenv("COLAB_SHARED_SECRET", "")
+    # I2V_ENABLED=0 runs an API-only replica: no /svd routes, no inference workers
+    I2V_ENABLED: bool = os.getenv("I2V_ENABLED", "1") == "1"
 
 settings = Settings()
\ No newline at end of file
@@ -6,10 +6,13 @@ from pathlib import Path
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
+from app.core.config import settings
 from app.logging_setup import RequestIDFilter, request_id_var
 from app.routers.video import router as video_router
 from app.routers.colab import router as colab_router
-from app.routers.svd import router as svd_router
+from app.routers.metrics import router as metrics_router
+from app.services import metrics
+from app.services.render_jobs import RENDERS
 
 RequestIDFilter.setup_Logging("INFO")
 
@@ -30,13 +33,18 @@ async def add_request_id_and_timing(request: Request, call_next):
     rid = str(uuid.uuid4())
     token = request_id_var.set(rid)
     start = time.perf_counter()
+    status = 500
     try:
         logger.info(f"Start request {request.method} {request.url.path}")
         response = await call_next(request)
+        status = response.status_code
         return response
     finally:
         duration = (time.perf_counter() - start) * 1000
         logger.info(f"Completed request {request.method} {request.url.path} in {duration:.2f}ms")
+        # label by route template so /svd/status/{job_id} is one series, not one per job
+        route = getattr(request.scope.get("route"), "path", "unmatched")
+        metrics.REQUEST_SECONDS.observe(duration / 1000.0, method=request.method, route=route, status=status)
         request_id_var.reset(token)
 
 APP_DIR = Path(__file__).resolve().parent
@@ -46,4 +54,20 @@ app.mount("/static", StaticFiles(directory=str(STATIC_ROOT)), name="static")
 
 app.include_router(video_router)
 app.include_router(colab_router)
-app.include_router(svd_router)
+app.include_router(metrics_router)
+if settings.I2V_ENABLED:
+    # the i2v job queue (and, in its workers, torch) is only imported by replicas that serve it
+    from app.routers.svd import router as svd_router
+    app.include_router(svd_router)
+
+@app.on_event("startup")
+def _start_i2v():
+    if not settings.I2V_ENABLED:
+        return
+    from app.services.i2v_worker import recover_jobs, warm_up
+    recover_jobs()
+    warm_up()
+
+@app.on_event("shutdown")
+def _stop_render_pool():
+    RENDERS.shutdown()
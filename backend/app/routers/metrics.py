@@ -0,0 +1,42 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+from app.core.config import settings
+from app.services import metrics
+from app.services.render_jobs import RENDERS
+
+router = APIRouter(tags=["metrics"])
+
+I2V_STATUSES = ("queued", "running", "cancelling", "done", "failed", "cancelled")
+RENDER_STATUSES = ("queued", "running", "done", "failed")
+
+@router.get("/metrics", response_class=PlainTextResponse)
+def prometheus_metrics():
+    with RENDERS.lock:
+        render_ids = list(RENDERS.jobs)
+    # ``get`` also flips queued -> running; a job pruned meanwhile is simply skipped
+    render_status = [job.status for job in map(RENDERS.get, render_ids) if job is not None]
+    api = metrics.proc_stats()
+    blocks = []
+    workers = []
+    if settings.I2V_ENABLED:
+        from app.services.i2v_worker import JOBS
+        workers = [(s.idx, metrics.proc_stats(s.proc.pid)) for s in JOBS.slots if s.proc is not None]
+        blocks.append(metrics.gauge("i2v_jobs", "i2v jobs by status.",
+                                    [({"status": st}, JOBS.count(st)) for st in I2V_STATUSES]))
+        blocks.append(metrics.gauge(
+            "i2v_model_weights_bytes", "Pipeline weights held by each i2v worker (mapped = shared safetensors pages).",
+            [({"worker": str(s.idx), "kind": kind}, s.model_memory.get(f"{kind}_bytes", 0))
+             for s in JOBS.slots for kind in ("weights", "mapped")]))
+
+    blocks += [
+        metrics.gauge("render_jobs", "Preset render jobs in memory by status.",
+                      [({"status": st}, render_status.count(st)) for st in RENDER_STATUSES]),
+        metrics.gauge("process_resident_memory_bytes", "Resident memory of the API process and i2v workers.",
+                      [({"process": "api"}, api.get("rss_bytes", 0.0))]
+                      + [({"process": f"i2v-worker-{i}"}, st.get("rss_bytes", 0.0)) for i, st in workers]),
+        metrics.gauge("process_threads", "OS threads of the API process and i2v workers.",
+                      [({"process": "api"}, api.get("threads", 0.0))]
+                      + [({"process": f"i2v-worker-{i}"}, st.get("threads", 0.0)) for i, st in workers]),
+    ]
+    return PlainTextResponse(metrics.render(blocks), media_type="text/plain; version=0.0.4")
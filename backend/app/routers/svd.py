@@ -1,10 +1,19 @@
 
 from __future__ import annotations
 from fastapi import APIRouter, UploadFile, File, Form, HTTPException, Request
+from fastapi.responses import StreamingResponse
 from PIL import Image
+import asyncio
 import io
+import json
+from pathlib import Path
 
-from app.services.i2v_worker import create_job, get_job
+from app.services.encode import ENCODE_PROFILES
+from app.services.i2v_worker import (
+    create_job, get_job, cancel_job, job_event, output_timing, INFERENCE_MODES, I2V_MODE,
+    I2V_MAX_FRAMES, I2V_MAX_OUTPUT_SIDE, I2V_MAX_OUTPUT_FPS, JOBS, TERMINAL, PROFILE_SUMMARY,
+    I2V_IDLE_UNLOAD_S, I2V_MMAP_WEIGHTS, I2V_DEFAULT_FRAMES, I2V_DEFAULT_MAX_SIDE, model_loaded, worker_health,
+)
 
 router = APIRouter(prefix="/svd", tags=["svd"])
 
@@ -13,15 +22,23 @@ async def start(
     image: UploadFile = File(...),
     frames: int | None = Form(None),
     fps: int = Form(9),
-    max_side: int = Form(320),
+    max_side: int = Form(I2V_DEFAULT_MAX_SIDE),
     steps: int = Form(6),
     denoise_strength: float = Form(0.4),
     cfg: float = Form(1.0),
     seed: int | None = Form(None),
     prompt: str | None = Form(None),
     negative_prompt: str | None = Form(None),
+    mode: str | None = Form(None),
+    priority: int = Form(0),
+    encode_profile: str | None = Form(None),
+    loop: bool = Form(False),
+    output_side: int | None = Form(None),
+    sky_crop: bool = Form(False),
+    output_fps: int | None = Form(None),
+    profile: bool | None = Form(None),
 ):
-    frames = frames or 20
+    frames = frames or I2V_DEFAULT_FRAMES
     data = await image.read()
 
     try:
@@ -29,19 +46,30 @@ async def start(
     except Exception:
         raise HTTPException(status_code=400, detail="invalid image")
 
-    frames = int(max(6, min(frames, 28)))
+    frames = int(max(6, min(frames, I2V_MAX_FRAMES)))
     fps = int(max(6, min(fps, 12)))
     max_side = int(max(256, min(max_side, 512)))
     steps = int(max(2, min(steps, 8)))
     denoise_strength = float(max(0.2, min(denoise_strength, 0.7)))
     cfg = float(max(0.0, min(cfg, 3.0)))
+    if output_fps is not None:
+        output_fps = int(max(fps, min(output_fps, I2V_MAX_OUTPUT_FPS)))
+    if output_side is not None:
+        output_side = int(max(max_side, min(output_side, I2V_MAX_OUTPUT_SIDE)))
+    if mode is not None and mode not in INFERENCE_MODES:
+        raise HTTPException(status_code=400, detail=f"mode must be one of {', '.join(INFERENCE_MODES)}")
+    if encode_profile is not None and encode_profile not in ENCODE_PROFILES:
+        raise HTTPException(status_code=400, detail=f"encode_profile must be one of {', '.join(ENCODE_PROFILES)}")
 
     try:
         job = create_job(
             data,
             frames=frames, fps=fps, max_side=max_side, steps=steps,
             denoise_strength=denoise_strength, cfg=cfg, seed=seed,
-            prompt=prompt, negative_prompt=negative_prompt,
+            prompt=prompt, negative_prompt=negative_prompt, mode=mode,
+            priority=priority, encode_profile=encode_profile, loop=loop,
+            output_side=output_side, sky_crop=sky_crop,
+            output_fps=output_fps, profile=profile,
         )
     except RuntimeError as e:
         raise HTTPException(status_code=429, detail=str(e))
@@ -53,12 +81,41 @@ def status(job_id: str):
     job = get_job(job_id)
     if not job:
         raise HTTPException(status_code=404, detail="job not found")
-    return {
-        "job_id": job.id,
-        "status": job.status,
-        "progress": {"current": job.current, "total": job.total, "eta_seconds": job.eta_seconds},
-        "error": job.error
-    }
+    return job_event(job)
+
+@router.get("/events/{job_id}")
+async def events(job_id: str, request: Request, preview: bool = False):
+    """Server-Sent Events: one ``data:`` line per state/progress change until the job ends.
+
+    With ``preview=true`` step events carry a small JPEG data URL decoded
+    linearly from the latents.
+    """
+    q = JOBS.subscribe(job_id, asyncio.get_running_loop())
+    job = get_job(job_id)
+    if not job:
+        JOBS.unsubscribe(job_id, q)
+        raise HTTPException(status_code=404, detail="job not found")
+
+    async def stream():
+        try:
+            yield f"data: {json.dumps(job_event(job))}\n\n"
+            if job.status in TERMINAL:
+                return
+            while not await request.is_disconnected():
+                try:
+                    event = await asyncio.wait_for(q.get(), timeout=15.0)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                if not preview and "preview" in event:
+                    event = {k: v for k, v in event.items() if k != "preview"}
+                yield f"data: {json.dumps(event)}\n\n"
+                if event["status"] in TERMINAL:
+                    return
+        finally:
+            JOBS.unsubscribe(job_id, q)
+
+    return StreamingResponse(stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
 
 @router.get("/result/{job_id}")
 def result(job_id: str, request: Request):
@@ -70,14 +127,71 @@ def result(job_id: str, request: Request):
 
     rel = f"/static/jobs/{job.id}/out.mp4"
     base = str(request.base_url).rstrip("/")
-    duration_s = job.params["frames"] / float(job.params["fps"])
+    _, frames, fps = output_timing(job.params)
+    duration_s = frames / float(fps)
     return {
         "job_id": job.id,
         "video_path": rel.lstrip("/"),
         "video_url": f"{base}{rel}",
-        "frames": job.params["frames"],
-        "fps": job.params["fps"],
+        "frames": frames,
+        "fps": fps,
         "duration_s": duration_s,
         "seed": job.params.get("seed"),
         "params": job.params,
+        "encode": job.encode,
     }
+
+@router.get("/profile/{job_id}")
+def profile_summary(job_id: str, request: Request, top: int = 20):
+    """Most expensive CPU ops of a job run with ``profile=true``, plus links to the full trace."""
+    job = get_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="job not found")
+    path = Path(job.job_dir) / PROFILE_SUMMARY
+    if not path.exists():
+        if job.params.get("profile") and job.status not in TERMINAL:
+            raise HTTPException(status_code=409, detail=f"profile not ready (status={job.status})")
+        raise HTTPException(status_code=404, detail="no profile for this job (submit it with profile=true)")
+    summary = json.loads(path.read_text(encoding="utf-8"))
+
+    top = max(1, top)
+    base = f"{str(request.base_url).rstrip('/')}/static/jobs/{job.id}"
+    return {
+        "job_id": job.id,
+        "batch": summary["jobs"],
+        "wall_s": summary["wall_s"],
+        "threads": summary["threads"],
+        "interop_threads": summary["interop_threads"],
+        "cpu_affinity": summary["cpu_affinity"],
+        "top_ops": summary["top_ops"][:top],
+        "top_ops_by_stack": summary["top_ops_by_stack"][:top],
+        "trace_url": f"{base}/{summary['trace']}",
+        "stacks_url": f"{base}/{summary['stacks']}",
+    }
+
+@router.get("/health")
+def health():
+    """Worker liveness and resident model memory (``rss_file_bytes`` is shared, mapped weights)."""
+    return {
+        "model_loaded": model_loaded(),
+        "idle_unload_s": I2V_IDLE_UNLOAD_S,
+        "mmap_weights": I2V_MMAP_WEIGHTS,
+        "queued": JOBS.count("queued"),
+        "running": JOBS.count("running"),
+        "workers": worker_health(),
+    }
+
+@router.get("/modes")
+def modes():
+    return {"default": I2V_MODE, "available": list(INFERENCE_MODES), "report": JOBS.mode_report,
+            "cost_model": JOBS.cost.snapshot()}
+
+@router.delete("/{job_id}")
+def cancel(job_id: str):
+    job = cancel_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="job not found")
+    if job.status in ("done", "failed"):
+        raise HTTPException(status_code=409, detail=f"job already finished (status={job.status})")
+    # a shared job stays queued/running while other requesters still want it
+    return {"job_id": job.id, "status": job.status, "requesters": job.requesters}
@@ -1,89 +1,101 @@
 import logging
-from fastapi import APIRouter, UploadFile, File, Form, HTTPException
+from typing import Dict
+from fastapi import APIRouter, Depends, UploadFile, File, Form, HTTPException
 from fastapi.responses import JSONResponse
-from app.utils.io import save_upload, make_output_path, ensure_max_width
-from app.services.presets import load_image_rgb, static_video_frames, light_pulse_frames
-from app.services.encode import write_mp4
-from app.services.sky_anim import sky_frames
+from app.utils.io import save_upload_async, make_output_path
+from app.services.encode import ENCODE_PROFILES
+from app.services.render_jobs import RENDERS, render_event
 
 logger = logging.getLogger("app.routers.video")
 router = APIRouter(prefix="/video", tags=["video"])
 
-@router.post("/static")
-async def video_static(file: UploadFile = File(...),
+def _check_profile(encode_profile: str | None) -> str | None:
+    if encode_profile is not None and encode_profile not in ENCODE_PROFILES:
+        raise HTTPException(status_code=400, detail=f"encode_profile must be one of {', '.join(ENCODE_PROFILES)}")
+    return encode_profile
+
+def static_params(
     duration_s: float = Form(8.0),
     fps: int = Form(24),
-):  
-    path = save_upload(file)
-    image = load_image_rgb(path)
-    total_frames = max(1, int(duration_s * fps))
-    frames = static_video_frames(image, total_frames)
-    out_path = make_output_path("mp4")
-    write_mp4(frames, out_path, fps)
-    return JSONResponse(content={"video_path": str(out_path)})
+    encode_profile: str | None = Form(None),
+) -> Dict:
+    return {"duration_s": duration_s, "fps": fps, "encode_profile": _check_profile(encode_profile)}
 
-@router.post("/light")
-async def video_light(
-    file: UploadFile = File(...),
+def light_params(
     duration_s: float = Form(8.0),
     fps: int = Form(24),
     amplitude: float = Form(0.03),
-    period_s: float = Form(6.0)
-):  
-    path = save_upload(file)
-    image = load_image_rgb(path)
-    total_frames = max(1, int(duration_s * fps))
-    frames = light_pulse_frames(image, total_frames, fps, amplitude, period_s)
-    out_path = make_output_path("mp4")
-    write_mp4(frames, out_path, fps)
-    return JSONResponse(content={"video_path": str(out_path)})
+    period_s: float = Form(6.0),
+    encode_profile: str | None = Form(None),
+) -> Dict:
+    return {"duration_s": duration_s, "fps": fps, "amplitude": amplitude, "period_s": period_s,
+            "encode_profile": _check_profile(encode_profile)}
 
-
-@router.post("/sky")
-async def video_sky(
-    file: UploadFile = File(...),
+def sky_params(
     duration_s: float = Form(4.0),
     fps: int = Form(24),
     intensity: float = Form(0.4),
     hue_bias: float = Form(0.0),
     feather_px: int = Form(8),
-):
-    
-    try:
-        path = save_upload(file)
-        logger.info(f"Saved upload to {path}")
-        
-        image = load_image_rgb(path)
-        logger.info("Loaded image shape=%s dtype=%s", getattr(image, 'shape', "?"), getattr(image, 'dtype', "?"))
-        
-        image = ensure_max_width(image, 1280)
-        logger.info("Resized (if needed) image shape=%s", getattr(image, 'shape', "?"))
-        frames = sky_frames(
-            rgb = image,
-            duration_s=duration_s,
-            fps=fps,
-            intensity=intensity,
-            hue_bias=hue_bias,
-            feather_px=feather_px,
-            sky_speed_px_per_s=20.0, 
-            mask_gamma=0.75,
-            mask_gain=2.0,
-            sky_contrast=1.6,
-            sky_mode="bands",
-            lighten_only=True,
-        )
+    encode_profile: str | None = Form(None),
+) -> Dict:
+    return {"duration_s": duration_s, "fps": fps, "intensity": intensity,
+            "hue_bias": hue_bias, "feather_px": feather_px,
+            "encode_profile": _check_profile(encode_profile)}
 
-        logger.info("Generated sky frames")
+async def _render(kind: str, file: UploadFile, params: Dict) -> JSONResponse:
+    path = await save_upload_async(file)
+    logger.info(f"Saved upload to {path}")
+    out_path = make_output_path("mp4")
+    job = await RENDERS.run(kind, path, out_path, params)
+    logger.info("Finished %s render %s", kind, out_path)
+    return JSONResponse(content={"video_path": job.video_path, "encode": job.encode})
 
-        out_path = make_output_path("mp4")
-        logger.info(f"Writing output video to {out_path}")
+async def _submit(kind: str, file: UploadFile, params: Dict) -> Dict:
+    path = await save_upload_async(file)
+    job = RENDERS.submit(kind, path, make_output_path("mp4"), params)
+    return {"job_id": job.id, "status": job.status}
 
-        write_mp4(frames, out_path, fps)
-        logger.info("Finished writing video")
+@router.post("/static")
+async def video_static(file: UploadFile = File(...), params: Dict = Depends(static_params)):
+    return await _render("static", file, params)
 
-        return JSONResponse(content={"video_path": str(out_path)})
+@router.post("/light")
+async def video_light(file: UploadFile = File(...), params: Dict = Depends(light_params)):
+    return await _render("light", file, params)
 
+@router.post("/sky")
+async def video_sky(file: UploadFile = File(...), params: Dict = Depends(sky_params)):
+    try:
+        return await _render("sky", file, params)
     except Exception as e:
         logger.exception("video_sky failed")
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.post("/static/jobs")
+async def submit_static(file: UploadFile = File(...), params: Dict = Depends(static_params)):
+    return await _submit("static", file, params)
+
+@router.post("/light/jobs")
+async def submit_light(file: UploadFile = File(...), params: Dict = Depends(light_params)):
+    return await _submit("light", file, params)
+
+@router.post("/sky/jobs")
+async def submit_sky(file: UploadFile = File(...), params: Dict = Depends(sky_params)):
+    return await _submit("sky", file, params)
+
+@router.get("/jobs/{job_id}")
+def job_status(job_id: str):
+    job = RENDERS.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="job not found")
+    return render_event(job)
+
+@router.get("/jobs/{job_id}/result")
+def job_result(job_id: str):
+    job = RENDERS.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="job not found")
+    if job.status != "done":
+        raise HTTPException(status_code=409, detail=f"job not ready (status={job.status})")
+    return {"job_id": job.id, "video_path": job.video_path, "params": job.params, "encode": job.encode}
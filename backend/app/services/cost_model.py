@@ -0,0 +1,112 @@
+
+from __future__ import annotations
+import json, os, threading
+from pathlib import Path
+from typing import Dict
+
+# Seconds per denoise step at 320 px before anything has been measured.
+PRIOR_STEP_S = 3.5
+PRIOR_OVERHEAD_S = 5.0
+EWMA_ALPHA = 0.3
+
+class CostModel:
+    """Online estimate of i2v job cost, fitted from the timings workers report.
+
+    Per-step latency is modelled per ``mode|threads`` group as a least-squares
+    line over work units (batch x frames x megapixels of the denoise size), with
+    an EWMA per exact shape taking precedence once that shape has been seen.
+    Non-denoise time (image prep, VAE decode, encode) is an EWMA per group.
+    State is a small JSON file so estimates survive restarts.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._fits: Dict[str, Dict[str, float]] = {}
+        self._exact: Dict[str, float] = {}
+        self._overhead: Dict[str, float] = {}
+        self._load()
+
+    def _load(self) -> None:
+        try:
+            state = json.loads(self.path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return
+        self._fits = state.get("fits", {})
+        self._exact = state.get("exact", {})
+        self._overhead = state.get("overhead", {})
+
+    def _save(self) -> None:
+        tmp = self.path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(
+            {"fits": self._fits, "exact": self._exact, "overhead": self._overhead}
+        ), encoding="utf-8")
+        os.replace(tmp, self.path)
+
+    @staticmethod
+    def _group(mode: str, threads: int) -> str:
+        return f"{mode}|{threads}"
+
+    @staticmethod
+    def _units(frames: int, width: int, height: int, batch: int) -> float:
+        return batch * frames * width * height / 1e6
+
+    @staticmethod
+    def _shape(group: str, frames: int, width: int, height: int, batch: int) -> str:
+        return f"{group}|{frames}|{width}x{height}|{batch}"
+
+    def observe(self, t: Dict) -> None:
+        """Fold in one run: ``mode, threads, frames, width, height, batch, step_s, overhead_s``."""
+        group = self._group(t["mode"], t["threads"])
+        x = self._units(t["frames"], t["width"], t["height"], t["batch"])
+        y = float(t["step_s"])
+        shape = self._shape(group, t["frames"], t["width"], t["height"], t["batch"])
+        with self._lock:
+            f = self._fits.setdefault(group, {"n": 0, "sx": 0.0, "sy": 0.0, "sxx": 0.0, "sxy": 0.0})
+            f["n"] += 1
+            f["sx"] += x
+            f["sy"] += y
+            f["sxx"] += x * x
+            f["sxy"] += x * y
+            prev = self._exact.get(shape)
+            self._exact[shape] = y if prev is None else prev + EWMA_ALPHA * (y - prev)
+            prev = self._overhead.get(group)
+            oh = float(t.get("overhead_s", 0.0)) / max(1, t["batch"])
+            self._overhead[group] = oh if prev is None else prev + EWMA_ALPHA * (oh - prev)
+            try:
+                self._save()
+            except OSError:
+                pass
+
+    def step_seconds(self, mode: str, threads: int, frames: int, width: int, height: int,
+                     batch: int = 1) -> float:
+        group = self._group(mode, threads)
+        with self._lock:
+            exact = self._exact.get(self._shape(group, frames, width, height, batch))
+            if exact is not None:
+                return exact
+            f = self._fits.get(group)
+        x = self._units(frames, width, height, batch)
+        if f and f["n"] >= 2:
+            den = f["n"] * f["sxx"] - f["sx"] ** 2
+            if den > 1e-12:
+                b = (f["n"] * f["sxy"] - f["sx"] * f["sy"]) / den
+                a = (f["sy"] - b * f["sx"]) / f["n"]
+                if b > 0:
+                    return max(0.05, a + b * x)
+            return f["sy"] / f["n"]
+        return PRIOR_STEP_S * max(0.5, (max(width, height) / 320.0) ** 2)
+
+    def overhead_seconds(self, mode: str, threads: int) -> float:
+        with self._lock:
+            return self._overhead.get(self._group(mode, threads), PRIOR_OVERHEAD_S)
+
+    def job_seconds(self, mode: str, threads: int, frames: int, width: int, height: int,
+                    steps: int, batch: int = 1) -> float:
+        return (steps * self.step_seconds(mode, threads, frames, width, height, batch)
+                + self.overhead_seconds(mode, threads))
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {"exact": dict(self._exact), "overhead": dict(self._overhead),
+                    "groups": {g: int(f["n"]) for g, f in self._fits.items()}}
@@ -1,15 +1,177 @@
+import os
+import queue
+import threading
+import time
+from dataclasses import dataclass
 from pathlib import Path
-from imageio.v3 import imwrite
+from typing import Dict, Iterable, Optional
+import imageio_ffmpeg
 import numpy as np
 
-def write_mp4(frames: list[np.ndarray], out_path: Path, fps: int = 24) -> Path:
-    arrs = []
-    for f in frames:
-        if f.dtype != np.uint8:
-            f = f.clip(0, 255).astype(np.uint8)
-        if f.ndim == 2:
-            f = np.stack([f] * 3, axis=-1) 
-        arrs.append(f)
-
-    imwrite(out_path.as_posix(), arrs, fps=fps, codec="libx264")
-    return out_path
\ No newline at end of file
+ENCODE_QUEUE_SIZE = int(os.getenv("ENCODE_QUEUE_SIZE", "8"))
+
+# libx264 settings per use; clips are mostly static renders, hence ``stillimage``.
+ENCODE_PROFILES: Dict[str, Dict] = {
+    "fast-preview": {"preset": "ultrafast", "crf": 28, "tune": "stillimage", "pix_fmt": "yuv420p"},
+    "web": {"preset": "medium", "crf": 23, "tune": "stillimage", "pix_fmt": "yuv420p",
+            "extra": ["-movflags", "+faststart"]},
+    "archive": {"preset": "slow", "crf": 16, "tune": "stillimage", "pix_fmt": "yuv444p"},
+}
+ENCODE_PROFILE = os.getenv("ENCODE_PROFILE", "web")
+# a typo in the default would otherwise only surface as a 500 on the first render
+if ENCODE_PROFILE not in ENCODE_PROFILES:
+    raise ValueError(f"ENCODE_PROFILE must be one of {', '.join(ENCODE_PROFILES)}, got {ENCODE_PROFILE!r}")
+
+_END = object()
+
+
+def _as_rgb24(f: np.ndarray) -> np.ndarray:
+    if f.dtype != np.uint8:
+        f = f.clip(0, 255).astype(np.uint8)
+    if f.ndim == 2:
+        f = np.stack([f] * 3, axis=-1)
+    elif f.shape[2] == 4:
+        f = f[..., :3]
+    return np.ascontiguousarray(f)
+
+
+def encoder_threads() -> int:
+    """Cores this process (and so its ffmpeg child) may run on."""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def resolve_profile(profile: Optional[str]) -> str:
+    name = profile or ENCODE_PROFILE
+    if name not in ENCODE_PROFILES:
+        raise ValueError(f"encode profile must be one of {', '.join(ENCODE_PROFILES)}")
+    return name
+
+
+def _output_params(settings: Dict, threads: int) -> list:
+    return [
+        "-preset", settings["preset"],
+        "-crf", str(settings["crf"]),
+        "-tune", settings["tune"],
+        "-threads", str(threads),
+        *settings.get("extra", []),
+    ]
+
+
+@dataclass
+class EncodeStats:
+    path: Path
+    profile: str
+    frames: int
+    fps: int
+    threads: int
+    encode_s: float
+    bitrate_kbps: float
+
+    def as_meta(self) -> Dict:
+        return {
+            "profile": self.profile,
+            "frames": self.frames,
+            "threads": self.threads,
+            "encode_s": round(self.encode_s, 3),
+            "bitrate_kbps": round(self.bitrate_kbps, 1),
+        }
+
+
+def write_mp4(
+    frames: Iterable[np.ndarray],
+    out_path: Path,
+    fps: int = 24,
+    profile: Optional[str] = None,
+    threads: Optional[int] = None,
+) -> EncodeStats:
+    """Stream frames into libx264 without materialising the clip.
+
+    Frames are pulled from ``frames`` (any iterable, typically a generator) on
+    the calling thread and handed to an encoder thread through a bounded queue,
+    so generation and encoding overlap and at most ``ENCODE_QUEUE_SIZE`` frames
+    are alive at once regardless of clip length.
+
+    ``profile`` names an entry of ``ENCODE_PROFILES`` (default ``ENCODE_PROFILE``);
+    x264 gets ``threads`` threads, by default as many as this process may use.
+    ``encode_s`` in the result is the time the encoder thread spent feeding and
+    flushing ffmpeg, not the overlapping frame generation.
+    """
+    profile = resolve_profile(profile)
+    settings = ENCODE_PROFILES[profile]
+    threads = max(1, threads or encoder_threads())
+    q: "queue.Queue" = queue.Queue(maxsize=max(1, ENCODE_QUEUE_SIZE))
+    errors: list[BaseException] = []
+    busy = [0.0]
+
+    def _encode():
+        writer = None
+        size = None
+        try:
+            while True:
+                f = q.get()
+                if f is _END:
+                    break
+                t = time.perf_counter()
+                if writer is None:
+                    size = f.shape[:2]
+                    writer = imageio_ffmpeg.write_frames(
+                        out_path.as_posix(),
+                        (size[1], size[0]),
+                        fps=fps,
+                        codec="libx264",
+                        pix_fmt_out=settings["pix_fmt"],
+                        quality=None,
+                        output_params=_output_params(settings, threads),
+                        macro_block_size=2,
+                    )
+                    writer.send(None)
+                elif f.shape[:2] != size:
+                    raise ValueError(f"frame size changed mid-stream: {f.shape[:2]} != {size}")
+                writer.send(f)
+                busy[0] += time.perf_counter() - t
+        except BaseException as e:
+            errors.append(e)
+            while q.get() is not _END:
+                pass
+        finally:
+            if writer is not None:
+                t = time.perf_counter()
+                writer.close()
+                busy[0] += time.perf_counter() - t
+
+    encoder = threading.Thread(target=_encode, name="mp4-encoder", daemon=True)
+    encoder.start()
+
+    count = 0
+    try:
+        for f in frames:
+            if errors:
+                break
+            q.put(_as_rgb24(f))
+            count += 1
+    except BaseException:
+        q.put(_END)
+        encoder.join()
+        out_path.unlink(missing_ok=True)
+        raise
+    q.put(_END)
+    encoder.join()
+
+    if not errors and count == 0:
+        errors.append(ValueError("no frames to encode"))
+    if errors:
+        out_path.unlink(missing_ok=True)
+        raise errors[0]
+    duration_s = count / float(fps)
+    return EncodeStats(
+        path=out_path,
+        profile=profile,
+        frames=count,
+        fps=fps,
+        threads=threads,
+        encode_s=busy[0],
+        bitrate_kbps=out_path.stat().st_size * 8 / 1000.0 / duration_s,
+    )
@@ -0,0 +1,899 @@
+
+from __future__ import annotations
+import io, os, time, threading, copy, statistics, hashlib, base64, json, shutil, struct, gc, ctypes
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+import torch
+
+from app.services.encode import write_mp4
+from app.services.interp import interpolate_frames
+from app.services.sky_anim import sky_mask
+from app.services.i2v_worker import (
+    Job, logger, PROMPT_DEFAULT, NEG_PROMPT_DEFAULT,
+    MOTION_ADAPTER_ID, BASE_MODEL_ID, LCM_REPO, LCM_WEIGHT_NAME, LCM_LORA_WEIGHT,
+    INFERENCE_MODES, I2V_MODE, I2V_MMAP_WEIGHTS, JobInterrupted, JobCancelled, JobPreempted,
+    I2V_DEFAULT_FRAMES, I2V_DEFAULT_MAX_SIDE, I2V_WARMUP_SIZE, denoise_steps,
+    I2V_CONTEXT_FRAMES, I2V_CONTEXT_OVERLAP, I2V_SKY_CROP_PAD, _load_and_resize_image, _resized_size, _sky_crop,
+    output_timing, resolve_mode,
+    PROFILE_SUMMARY,
+)
+
+from diffusers import AnimateDiffVideoToVideoPipeline, MotionAdapter, LCMScheduler
+from diffusers.models.unets.unet_3d_condition import UNet3DConditionOutput
+from diffusers.utils.logging import set_verbosity_info as df_set_info
+import transformers
+
+df_set_info()
+transformers.utils.logging.set_verbosity_error()
+
+Report = Callable[..., None]
+Poll = Callable[[], Dict[str, str]]
+
+EMBED_CACHE_SIZE = int(os.getenv("EMBED_CACHE_SIZE", "32"))
+_embed_cache: "OrderedDict[tuple, torch.Tensor]" = OrderedDict()
+_embed_lock = threading.Lock()
+
+LATENT_CACHE_SIZE = int(os.getenv("LATENT_CACHE_SIZE", "8"))
+_latent_cache: "OrderedDict[tuple, Tuple[torch.Tensor, torch.Tensor]]" = OrderedDict()
+_latent_lock = threading.Lock()
+
+PROFILE_TOP_OPS = int(os.getenv("PROFILE_TOP_OPS", "50"))
+
+def _init_threads(num_threads: Optional[int] = None):
+    default_threads = num_threads or max(1, min(os.cpu_count() or 4, 6))
+    os.environ.setdefault("OMP_NUM_THREADS", str(default_threads))
+    os.environ.setdefault("MKL_NUM_THREADS", str(default_threads))
+    torch.set_num_threads(int(os.environ.get("TORCH_NUM_THREADS", default_threads)))
+    torch.set_num_interop_threads(int(os.environ.get("TORCH_NUM_INTEROP", 1)))
+
+_ST_DTYPES = {
+    "F64": np.float64, "F32": np.float32, "F16": np.float16,
+    "I64": np.int64, "I32": np.int32, "I16": np.int16, "I8": np.int8, "U8": np.uint8, "BOOL": np.bool_,
+}
+
+def _mmap_safetensors(path: str) -> Dict[str, torch.Tensor]:
+    """Tensors of a .safetensors file as copy-on-write views of one memory map.
+
+    Untouched pages stay in the page cache, so every process mapping the same
+    file shares them, and dropping the last reference unmaps them. Dtypes numpy
+    cannot view (bf16) are left out.
+    """
+    with open(path, "rb") as f:
+        (header_len,) = struct.unpack("<Q", f.read(8))
+        header = json.loads(f.read(header_len))
+    mm = np.memmap(path, dtype=np.uint8, mode="c")
+    base = 8 + header_len
+    tensors: Dict[str, torch.Tensor] = {}
+    for name, info in header.items():
+        dtype = _ST_DTYPES.get(info.get("dtype")) if name != "__metadata__" else None
+        if dtype is None:
+            continue
+        start, end = info["data_offsets"]
+        arr = mm[base + start:base + end].view(dtype).reshape(info["shape"])
+        if arr.flags.aligned:
+            tensors[name] = torch.from_numpy(arr)
+    return tensors
+
+def _weights(repo: str, filename: str) -> Dict[str, torch.Tensor]:
+    """Mapped tensors of ``filename`` from a model dir or the HF cache (fetched once if missing)."""
+    if os.path.isdir(repo):
+        return _mmap_safetensors(os.path.join(repo, filename))
+    from huggingface_hub import hf_hub_download
+    return _mmap_safetensors(hf_hub_download(repo, filename))
+
+_INIT_FNS = ("uniform_", "normal_", "trunc_normal_", "constant_", "ones_", "zeros_",
+             "kaiming_uniform_", "kaiming_normal_", "xavier_uniform_", "xavier_normal_", "orthogonal_")
+
+@contextmanager
+def _skip_init():
+    """Build modules without initialising their weights; ``_assign`` replaces them right away.
+
+    The skipped parameters are never written, so their pages never become resident.
+    """
+    saved = {name: getattr(torch.nn.init, name) for name in _INIT_FNS}
+    for name in _INIT_FNS:
+        setattr(torch.nn.init, name, lambda tensor, *args, **kwargs: tensor)
+    try:
+        yield
+    finally:
+        for name, fn in saved.items():
+            setattr(torch.nn.init, name, fn)
+
+def _assign(module: torch.nn.Module, tensors: Dict[str, torch.Tensor]) -> torch.nn.Module:
+    """Make the mapped ``tensors`` the weights of ``module``, without copying them.
+
+    Raises if a parameter has no tensor, or shape/dtype differ, so the caller
+    can fall back to a regular load.
+    """
+    state = module.state_dict()
+    params = {name for name, _ in module.named_parameters()}
+    for name, current in state.items():
+        src = tensors.get(name)
+        if src is None:
+            if name in params:
+                raise KeyError(f"{type(module).__name__}: no weight for {name}")
+            continue
+        if src.shape != current.shape or src.dtype != current.dtype:
+            raise ValueError(f"{type(module).__name__}.{name}: file has {src.dtype}{tuple(src.shape)}")
+    mapped = {name: t for name, t in tensors.items() if name in state}
+    module.load_state_dict(mapped, strict=False, assign=True)
+    if any(t.is_meta for t in (*module.parameters(), *module.buffers())):
+        raise RuntimeError(f"{type(module).__name__}: tensors left on the meta device")
+    ModelManager._mapped.update(t.data_ptr() for t in mapped.values())
+    return module.eval()
+
+def _mapped_components() -> Dict[str, torch.nn.Module]:
+    """Motion adapter, motion UNet, VAE and text encoder whose weights are safetensors maps.
+
+    Unlike ``from_pretrained``, nothing is read into private memory: a reload
+    only re-maps pages that are most likely still in the page cache, and
+    every worker process shares them.
+    """
+    from diffusers import AutoencoderKL, UNet2DConditionModel, UNetMotionModel
+    from transformers import CLIPTextConfig, CLIPTextModel
+    from transformers.modeling_utils import no_init_weights
+
+    motion = _weights(MOTION_ADAPTER_ID, "diffusion_pytorch_model.safetensors")
+    adapter_config = MotionAdapter.load_config(MOTION_ADAPTER_ID)
+    with _skip_init():
+        adapter = _assign(MotionAdapter.from_config(adapter_config), motion)
+        # from_unet2d only needs the configs (and moves the adapter to the UNet's device)
+        with torch.device("meta"):
+            unet2d = UNet2DConditionModel.from_config(UNet2DConditionModel.load_config(BASE_MODEL_ID, subfolder="unet"))
+            adapter_meta = MotionAdapter.from_config(adapter_config)
+        unet = UNetMotionModel.from_unet2d(unet2d, adapter_meta, load_weights=False)
+        unet = _assign(unet, {**_weights(BASE_MODEL_ID, "unet/diffusion_pytorch_model.safetensors"), **motion})
+        vae = _assign(AutoencoderKL.from_config(AutoencoderKL.load_config(BASE_MODEL_ID, subfolder="vae")),
+                      _weights(BASE_MODEL_ID, "vae/diffusion_pytorch_model.safetensors"))
+        with no_init_weights():
+            text_encoder = CLIPTextModel(CLIPTextConfig.from_pretrained(BASE_MODEL_ID, subfolder="text_encoder"))
+        text_encoder = _assign(text_encoder, _weights(BASE_MODEL_ID, "text_encoder/model.safetensors"))
+    return {"motion_adapter": adapter, "unet": unet, "vae": vae, "text_encoder": text_encoder}
+
+def _trim_heap() -> None:
+    """Hand freed heap pages back to the OS (glibc keeps them otherwise)."""
+    try:
+        ctypes.CDLL("libc.so.6").malloc_trim(0)
+    except (OSError, AttributeError):
+        pass
+
+class ModelManager:
+    _lock = threading.Lock()
+    _pipe: Optional[AnimateDiffVideoToVideoPipeline] = None
+    _loaded = False
+    _unets: Dict[str, torch.nn.Module] = {}
+    _load_s: Optional[float] = None
+    # data pointers of weights backed by safetensors memory maps
+    _mapped: set = set()
+
+    @classmethod
+    def get_pipe(cls) -> AnimateDiffVideoToVideoPipeline:
+        with cls._lock:
+            if cls._pipe is None:
+                t0 = time.perf_counter()
+                cls._pipe = cls._load_pipeline()
+                cls._load_s = time.perf_counter() - t0
+                cls._unets = {"fp32": cls._pipe.unet}
+                for text in (PROMPT_DEFAULT, NEG_PROMPT_DEFAULT):
+                    _text_embeds(cls._pipe, text)
+                cls._loaded = True
+            return cls._pipe
+
+    @classmethod
+    def unload(cls) -> None:
+        """Drop the pipeline and every UNet variant; the next job loads them again."""
+        with cls._lock:
+            if cls._pipe is None:
+                return
+            cls._pipe = None
+            cls._unets = {}
+            cls._mapped = set()
+            cls._loaded = False
+        gc.collect()
+        _trim_heap()
+
+    @classmethod
+    def pop_load_seconds(cls) -> Optional[float]:
+        """Pipeline load time, handed out once so it is recorded once."""
+        with cls._lock:
+            load_s, cls._load_s = cls._load_s, None
+        return load_s
+
+    @classmethod
+    def resolve_mode(cls, mode: Optional[str]) -> str:
+        # the API resolves it the same way when the job is created
+        return resolve_mode(mode)
+
+    @classmethod
+    def unet_for(cls, mode: str) -> torch.nn.Module:
+        """UNet variant for ``mode``; built once per process and shared by later jobs."""
+        cls.get_pipe()
+        with cls._lock:
+            unet = cls._unets.get(mode)
+            if unet is not None:
+                return unet
+            base = cls._unets["fp32"]
+            if mode == "bf16":
+                unet = base  # same weights, autocast at call time
+            elif mode == "int8":
+                # covers the spatial UNet and the motion-module attention/FF layers
+                unet = torch.ao.quantization.quantize_dynamic(
+                    copy.deepcopy(base), {torch.nn.Linear}, dtype=torch.qint8
+                )
+            elif mode == "compile":
+                unet = torch.compile(base)
+            else:
+                raise ValueError(f"unknown inference mode: {mode}")
+            cls._unets[mode] = unet
+            logger.info("Prepared UNet for inference mode '%s'", mode)
+            return unet
+
+    @staticmethod
+    def _load_pipeline() -> AnimateDiffVideoToVideoPipeline:
+        motion_adapter_id = MOTION_ADAPTER_ID
+        base_model_id    = BASE_MODEL_ID
+        lcm_repo         = LCM_REPO
+        lcm_weight_name  = LCM_WEIGHT_NAME
+        lcm_weight       = LCM_LORA_WEIGHT
+
+        components: Dict[str, torch.nn.Module] = {}
+        if I2V_MMAP_WEIGHTS:
+            try:
+                components = _mapped_components()
+            except Exception as e:
+                logger.warning("Memory-mapped weight load failed (%s); using from_pretrained", e)
+                ModelManager._mapped = set()
+        mapped = bool(components)
+        if not mapped:
+            components = {"motion_adapter": MotionAdapter.from_pretrained(motion_adapter_id)}
+        pipe = AnimateDiffVideoToVideoPipeline.from_pretrained(base_model_id, **components)
+
+        pipe.scheduler = LCMScheduler.from_config(pipe.scheduler.config, beta_schedule="linear")
+
+        try:
+            pipe.load_lora_weights(lcm_repo, weight_name=lcm_weight_name, adapter_name="lcm-lora")
+            pipe.set_adapters(["lcm-lora"], [lcm_weight])
+            logger.info("Loaded AnimateLCM LoRA '%s' (weight=%.2f)", lcm_weight_name, lcm_weight)
+        except Exception as e:
+            logger.warning("AnimateLCM LoRA not loaded: %s", e)
+
+        pipe.enable_attention_slicing()
+        pipe.enable_vae_slicing()
+        pipe.enable_vae_tiling()
+        # channels-last would copy every conv weight out of the shared maps
+        if not mapped:
+            try:
+                pipe.unet.to(memory_format=torch.channels_last)
+                pipe.vae.to(memory_format=torch.channels_last)
+            except Exception:
+                pass
+
+        pipe.set_progress_bar_config(disable=False)
+        pipe.to("cpu")
+        return pipe
+
+def _text_embeds(pipe: AnimateDiffVideoToVideoPipeline, text: str) -> torch.Tensor:
+    """CLIP embeddings for ``text``, LRU-cached per (text, base model)."""
+    key = (text, BASE_MODEL_ID)
+    with _embed_lock:
+        hit = _embed_cache.get(key)
+        if hit is not None:
+            _embed_cache.move_to_end(key)
+            return hit
+    with torch.inference_mode():
+        embeds, _ = pipe.encode_prompt(text, torch.device("cpu"), 1, False)
+    with _embed_lock:
+        _embed_cache[key] = embeds
+        while len(_embed_cache) > max(2, EMBED_CACHE_SIZE):
+            _embed_cache.popitem(last=False)
+    return embeds
+
+def _image_latent(pipe: AnimateDiffVideoToVideoPipeline, img: Image.Image,
+                  key: tuple) -> Tuple[torch.Tensor, torch.Tensor]:
+    """VAE posterior (mean, std), each (1, C, h, w), of one still, LRU-cached per (image hash, max_side)."""
+    key = (*key, BASE_MODEL_ID)
+    with _latent_lock:
+        hit = _latent_cache.get(key)
+        if hit is not None:
+            _latent_cache.move_to_end(key)
+            return hit
+    w, h = img.size
+    pixels = pipe.video_processor.preprocess(img, height=h, width=w).to(dtype=pipe.vae.dtype)
+    with torch.inference_mode():
+        dist = pipe.vae.encode(pixels).latent_dist
+        moments = (dist.mean, dist.std)
+    with _latent_lock:
+        _latent_cache[key] = moments
+        while len(_latent_cache) > max(1, LATENT_CACHE_SIZE):
+            _latent_cache.popitem(last=False)
+    return moments
+
+def _still_latents(pipe, moments: Tuple[torch.Tensor, torch.Tensor], frames: int, steps: int,
+                   strength: float, generator: torch.Generator) -> torch.Tensor:
+    """Noised (1, C, F, h, w) start latents for one still repeated over ``frames``.
+
+    Mirrors the pipeline's own video path: every frame's latent is sampled from the
+    (shared) posterior with the job's generator, then noise for the first timestep
+    after ``strength`` is drawn in (B, F, C, h, w) layout. Only the F identical VAE
+    encodes are skipped, so a seeded job draws the same random stream either way.
+    """
+    pipe.scheduler.set_timesteps(steps, device="cpu")
+    timesteps, _ = pipe.get_timesteps(steps, pipe.scheduler.timesteps, strength, "cpu")
+    mean, std = moments
+    _, c, h, w = mean.shape
+    eps = torch.randn((frames, c, h, w), generator=generator, dtype=mean.dtype)
+    init = ((mean + std * eps) * pipe.vae.config.scaling_factor).unsqueeze(0)
+    noise = torch.randn((1, frames, c, h, w), generator=generator, dtype=mean.dtype)
+    return pipe.scheduler.add_noise(init, noise, timesteps[:1]).permute(0, 2, 1, 3, 4).contiguous()
+
+@contextmanager
+def _inference_mode(pipe: AnimateDiffVideoToVideoPipeline, mode: str):
+    base = pipe.unet
+    pipe.unet = ModelManager.unet_for(mode)
+    try:
+        if mode == "bf16":
+            with torch.autocast("cpu", dtype=torch.bfloat16):
+                yield
+        else:
+            yield
+    finally:
+        pipe.unet = base
+
+def _context_windows(frames: int, size: int, overlap: int, loop: bool = False) -> List[List[int]]:
+    """Frame indices of each overlapping window; ``loop`` wraps windows past the end."""
+    if frames <= size:
+        return [list(range(frames))]
+    stride = max(1, size - overlap)
+    if loop:
+        return [[(s + k) % frames for k in range(size)] for s in range(0, frames, stride)]
+    starts = list(range(0, frames - size, stride)) + [frames - size]
+    return [list(range(s, s + size)) for s in starts]
+
+class _WindowedUNet(torch.nn.Module):
+    """Runs the wrapped motion UNet over fixed-size frame windows and blends the overlaps.
+
+    Each window's noise prediction is weighted by a triangle that peaks at the
+    window centre, so frames near a window edge take most of their prediction
+    from the neighbouring window. Activations only ever exist for one window.
+    """
+
+    def __init__(self, unet: torch.nn.Module, windows: List[List[int]]):
+        super().__init__()
+        self.inner = unet
+        self.windows = [torch.tensor(w) for w in windows]
+        size = len(windows[0])
+        self.weights = torch.tensor([min(k + 1, size - k) for k in range(size)], dtype=torch.float32)
+
+    def __getattr__(self, name):
+        try:
+            return super().__getattr__(name)
+        except AttributeError:
+            return getattr(self._modules["inner"], name)
+
+    def forward(self, sample: torch.Tensor, timestep, encoder_hidden_states=None, return_dict: bool = True,
+                **kwargs):
+        frames = sample.shape[2]
+        out = torch.zeros_like(sample, dtype=torch.float32)
+        norm = torch.zeros(frames, dtype=torch.float32)
+        for idx in self.windows:
+            pred = self.inner(sample.index_select(2, idx), timestep,
+                              encoder_hidden_states=encoder_hidden_states, **kwargs).sample
+            w = self.weights.view(1, 1, -1, 1, 1)
+            out.index_add_(2, idx, pred.float() * w)
+            norm.index_add_(0, idx, self.weights)
+        out = (out / norm.view(1, 1, -1, 1, 1)).to(sample.dtype)
+        return UNet3DConditionOutput(sample=out) if return_dict else (out,)
+
+@contextmanager
+def _context_window(pipe: AnimateDiffVideoToVideoPipeline, frames: int, loop: bool):
+    """Swap in a ``_WindowedUNet`` for clips longer than one context window."""
+    if frames <= I2V_CONTEXT_FRAMES:
+        yield
+        return
+    windows = _context_windows(frames, I2V_CONTEXT_FRAMES, I2V_CONTEXT_OVERLAP, loop)
+    logger.info("Context windows: %d x %d frames (overlap %d, loop=%s)",
+                len(windows), I2V_CONTEXT_FRAMES, I2V_CONTEXT_OVERLAP, loop)
+    base = pipe.unet
+    pipe.unet = _WindowedUNet(base, windows)
+    try:
+        yield
+    finally:
+        pipe.unet = base
+
+def _unet_inputs(unet: torch.nn.Module, frames: int, width: int, height: int, seed: int = 0):
+    g = torch.Generator(device="cpu").manual_seed(seed)
+    sample = torch.randn(1, unet.config.in_channels, frames, height // 8, width // 8, generator=g)
+    text = torch.randn(1, 77, unet.config.cross_attention_dim, generator=g)
+    return sample, torch.tensor([500]), text
+
+def _unet_step(mode: str, inputs) -> torch.Tensor:
+    sample, t, text = inputs
+    with torch.inference_mode(), _inference_mode(ModelManager.get_pipe(), mode):
+        out = ModelManager.get_pipe().unet(sample, t, encoder_hidden_states=text).sample
+    return out.float()
+
+def _warmup_shape() -> tuple:
+    """(frames, width, height) one UNet call sees for a request with the default parameters."""
+    if I2V_WARMUP_SIZE:
+        width, height = (int(v) for v in I2V_WARMUP_SIZE.lower().split("x"))
+    else:
+        width, height = I2V_DEFAULT_MAX_SIDE, I2V_DEFAULT_MAX_SIDE * 9 // 16
+    # long clips reach the UNet one context window at a time
+    frames = min(I2V_DEFAULT_FRAMES, I2V_CONTEXT_FRAMES)
+    return frames, width - width % 8, height - height % 8
+
+def warmup(mode: str = I2V_MODE) -> None:
+    """Load the pipeline and run one UNet step at the default job shape so the
+    first such job pays no setup (or ``torch.compile``) cost."""
+    mode = ModelManager.resolve_mode(mode)
+    t0 = time.time()
+    pipe = ModelManager.get_pipe()
+    _unet_step(mode, _unet_inputs(pipe.unet, *_warmup_shape()))
+    logger.info("Warm-up (%s) done in %.1f s", mode, time.time() - t0)
+
+def calibrate_modes(frames: int = 8, side: int = 256, reps: int = 3) -> Dict[str, Dict]:
+    """Per-step latency and output drift of every usable mode against fp32.
+
+    The same random latents go through one UNet step per mode; ``speedup`` is
+    the fp32 median step time over the mode's, and ``max_abs``/``rel_l2``
+    compare the noise prediction with the fp32 one.
+    """
+    pipe = ModelManager.get_pipe()
+    inputs = _unet_inputs(pipe.unet, frames, side, side)
+    report: Dict[str, Dict] = {}
+    ref = None
+    ref_ms = None
+    for mode in INFERENCE_MODES:
+        if ModelManager.resolve_mode(mode) != mode:
+            report[mode] = {"available": False}
+            continue
+        out = _unet_step(mode, inputs)  # first call also pays compile/quantize setup
+        times = []
+        for _ in range(reps):
+            t0 = time.perf_counter()
+            _unet_step(mode, inputs)
+            times.append((time.perf_counter() - t0) * 1000.0)
+        step_ms = statistics.median(times)
+        if ref is None:
+            ref, ref_ms = out, step_ms
+        diff = out - ref
+        report[mode] = {
+            "available": True,
+            "step_ms": round(step_ms, 1),
+            "speedup": round(ref_ms / step_ms, 2),
+            "max_abs": float(diff.abs().max()),
+            "rel_l2": float(diff.norm() / (ref.norm() + 1e-12)),
+        }
+        logger.info("mode %-7s %8.1f ms/step  x%.2f  rel_l2=%.2e",
+                    mode, step_ms, report[mode]["speedup"], report[mode]["rel_l2"])
+    return report
+
+def _prepare(pipe, job: Job) -> Dict:
+    """Per-job inputs: resized still, generator, embeddings and (if possible) start latents.
+
+    With ``sky_crop`` the denoised ``img`` is only the sky box of ``still``.
+    """
+    p = job.params
+    t0 = time.perf_counter()
+    with open(job.input_path, "rb") as f:
+        data = f.read()
+    img = _load_and_resize_image(data, p["max_side"])
+    # the pipeline wants sizes divisible by the VAE factor
+    sf = pipe.vae_scale_factor
+    img = img.crop((0, 0, img.width - img.width % sf, img.height - img.height % sf))
+    still, box = img, None
+    if p.get("sky_crop"):
+        box = _sky_crop(img)
+        if box is not None:
+            img = img.crop(box)
+    t1 = time.perf_counter()
+
+    generator = torch.Generator(device="cpu")
+    if p.get("seed") is not None:
+        generator = generator.manual_seed(int(p["seed"]))
+
+    prompt_txt   = (p.get("prompt") or "").strip() or PROMPT_DEFAULT
+    negative_txt = (p.get("negative_prompt") or "").strip() or NEG_PROMPT_DEFAULT
+
+    latents = None
+    try:
+        moments = _image_latent(pipe, img, (hashlib.sha256(data).hexdigest(), p["max_side"], box))
+        latents = _still_latents(
+            pipe, moments, p["frames"], int(p["steps"]), p["denoise_strength"], generator
+        )
+    except Exception as e:
+        logger.warning("Single-encode path unavailable, encoding every frame: %s", e)
+    t2 = time.perf_counter()
+    prompt_embeds = _text_embeds(pipe, prompt_txt)
+    negative_prompt_embeds = _text_embeds(pipe, negative_txt)
+
+    return dict(
+        img=img,
+        still=still,
+        box=box,
+        generator=generator,
+        prompt_embeds=prompt_embeds,
+        negative_prompt_embeds=negative_prompt_embeds,
+        latents=latents,
+        stages={"image_load": t1 - t0, "vae_encode": t2 - t1, "text_encode": time.perf_counter() - t2},
+    )
+
+def _paste_crop(still: Image.Image, box: tuple, frames: Iterator[np.ndarray]) -> Iterator[np.ndarray]:
+    """Whole low-res frames from denoised sky crops, blended in through the sky mask.
+
+    On sides where the crop does not reach the frame edge the mask is also
+    ramped to zero across the padding, so the crop's border never shows.
+    """
+    base = np.asarray(still, dtype=np.uint8)
+    left, top, right, bottom = box
+    region = base[top:bottom, left:right].astype(np.int32)
+    alpha = sky_mask(base)[top:bottom, left:right].copy()
+    h, w = alpha.shape
+    pad = max(1, I2V_SKY_CROP_PAD)
+    ys = np.arange(h, dtype=np.float32) + 0.5
+    xs = np.arange(w, dtype=np.float32) + 0.5
+    if top > 0:
+        alpha *= np.clip(ys / pad, 0.0, 1.0)[:, None]
+    if bottom < base.shape[0]:
+        alpha *= np.clip((h - ys) / pad, 0.0, 1.0)[:, None]
+    if left > 0:
+        alpha *= np.clip(xs / pad, 0.0, 1.0)[None, :]
+    if right < base.shape[1]:
+        alpha *= np.clip((w - xs) / pad, 0.0, 1.0)[None, :]
+    a8 = (alpha * 256.0 + 0.5).astype(np.int32)[..., None]
+
+    for fr in frames:
+        acc = fr.astype(np.int32)
+        acc -= region
+        acc *= a8
+        acc += 128
+        acc >>= 8
+        acc += region
+        out = base.copy()
+        out[top:bottom, left:right] = acc
+        yield out
+
+def _composite_frames(job: Job, still: Image.Image, frames: Iterator[np.ndarray]) -> Iterator[np.ndarray]:
+    """Full-resolution frames: the input still plus upsampled low-res sky motion.
+
+    Each denoised frame's difference from the low-res still it started from
+    is upsampled to the output size and added through the soft sky mask, in
+    8.8 fixed point like ``sky_anim``. Wherever the mask rounds to zero the
+    output pixel is the input pixel, bit for bit.
+
+    ``still`` lost up to 7 px on its right and bottom edges to latent
+    alignment, so the delta covers only the matching top-left part of the
+    full-res frame; the strip beyond it is left as the input.
+    """
+    full = Image.open(job.input_path).convert("RGB")
+    lo_w, lo_h = _resized_size(*full.size, job.params["max_side"])
+    side = job.params["output_side"]
+    if max(full.size) > side:
+        scale = side / max(full.size)
+        full = full.resize((round(full.width * scale), round(full.height * scale)), Image.LANCZOS)
+    # even sizes, so ffmpeg never rescales (and touches) the untouched pixels
+    base = np.asarray(full, dtype=np.uint8)[: full.height // 2 * 2, : full.width // 2 * 2]
+    h, w = base.shape[:2]
+    ch = min(h, round(full.height * still.height / lo_h))
+    cw = min(w, round(full.width * still.width / lo_w))
+
+    mask = sky_mask(base, feather_px=max(4, w // 160))
+    alpha = (mask[:ch, :cw] * 256.0 + 0.5).astype(np.int32)[..., None]
+    base_i = base[:ch, :cw].astype(np.int32)
+    still_t = torch.from_numpy(np.asarray(still, dtype=np.float32)).permute(2, 0, 1)
+
+    for fr in frames:
+        lo = torch.from_numpy(fr.astype(np.float32)).permute(2, 0, 1)
+        delta = torch.nn.functional.interpolate(
+            (lo - still_t)[None], size=(ch, cw), mode="bicubic", align_corners=False
+        )[0]
+        acc = delta.round().to(torch.int32).permute(1, 2, 0).numpy()
+        acc *= alpha
+        acc += 128
+        acc >>= 8
+        acc += base_i
+        out = base.copy()
+        out[:ch, :cw] = np.clip(acc, 0, 255)
+        yield out
+
+# Least-squares fit of SD1.5 latent channels to RGB; good enough for a thumbnail.
+_LATENT_RGB = torch.tensor([
+    [ 0.3512,  0.2297,  0.3227],
+    [ 0.3250,  0.4974,  0.2350],
+    [-0.2829,  0.1762,  0.2721],
+    [-0.2120, -0.2616, -0.7177],
+])
+
+def _latent_preview(latents: torch.Tensor, index: int) -> Optional[str]:
+    """JPEG data URL of the middle frame of sample ``index``, via a linear latent->RGB map."""
+    try:
+        lat = latents[index, :, latents.shape[2] // 2].float()
+        rgb = torch.einsum("chw,cr->hwr", lat, _LATENT_RGB)
+        rgb = ((rgb + 1.0) * 127.5).clamp(0, 255).to(torch.uint8).numpy()
+        buf = io.BytesIO()
+        Image.fromarray(rgb).save(buf, "JPEG", quality=70)
+        return "data:image/jpeg;base64," + base64.b64encode(buf.getvalue()).decode("ascii")
+    except Exception:
+        return None
+
+def _timed(frames: Iterator[np.ndarray], stages: Dict[str, float], stage: str) -> Iterator[np.ndarray]:
+    """Pass ``frames`` through, adding the time spent producing them to ``stages[stage]``."""
+    it = iter(frames)
+    while True:
+        t0 = time.perf_counter()
+        frame = next(it, None)
+        stages[stage] = stages.get(stage, 0.0) + time.perf_counter() - t0
+        if frame is None:
+            return
+        yield frame
+
+def _no_stops() -> Dict[str, str]:
+    return {}
+
+def _interruption(kind: str) -> JobInterrupted:
+    return JobCancelled() if kind == "cancel" else JobPreempted()
+
+def _denoise_and_encode(pipe, jobs: List[Job], reports: Dict[str, Report],
+                        poll: Poll = _no_stops) -> Dict[str, Optional[BaseException]]:
+    """One pipeline call for ``jobs`` (which share a batch key), then one MP4 per job.
+
+    ``poll`` is checked after every denoise step; once every job in the call has
+    been told to stop, the step callback raises ``JobInterrupted``.
+    """
+    p = jobs[0].params
+    t_start = time.time()
+    stages: Dict[str, float] = {}
+    load_s = ModelManager.pop_load_seconds()
+    if load_s is not None:
+        stages["model_load"] = load_s
+    samples = [_prepare(pipe, job) for job in jobs]
+    for s in samples:
+        for stage, seconds in s["stages"].items():
+            stages[stage] = stages.get(stage, 0.0) + seconds
+    if len(jobs) > 1 and any(s["latents"] is None for s in samples):
+        raise RuntimeError("batched run needs precomputed latents")
+
+    # progress and ETA count the steps actually run, as the queue's estimate does
+    steps_total = denoise_steps(p)
+    for job in jobs:
+        reports[job.id](total=steps_total)
+    mode = ModelManager.resolve_mode(p.get("mode"))
+
+    img = samples[0]["img"]
+    pipe_kwargs = dict(
+        height=img.height,
+        width=img.width,
+        prompt_embeds=torch.cat([s["prompt_embeds"] for s in samples]),
+        negative_prompt_embeds=torch.cat([s["negative_prompt_embeds"] for s in samples]),
+        num_inference_steps=int(p["steps"]),
+        guidance_scale=p["cfg"],
+        strength=p["denoise_strength"],
+        generator=[s["generator"] for s in samples] if len(samples) > 1 else samples[0]["generator"],
+    )
+    # the pipeline takes either a video to encode or ready start latents, never both
+    if samples[0]["latents"] is not None:
+        pipe_kwargs["latents"] = torch.cat([s["latents"] for s in samples])
+    else:
+        pipe_kwargs["video"] = [img] * p["frames"]
+
+    t0 = time.time()
+    last_t = t0
+    step_s: List[float] = []
+    def _on_step(_pipe, step_idx: int, timestep, callback_kwargs: Dict) -> Dict:
+        # diffusers ``callback_on_step_end``: runs after each scheduler step
+        nonlocal last_t
+        latents = callback_kwargs["latents"]
+        current = min(steps_total, step_idx + 1)
+        now = time.time()
+        step_ms = (now - last_t) * 1000.0
+        step_s.append(now - last_t)
+        last_t = now
+        elapsed = now - t0
+        done = max(1, current)
+        eta = max(0.0, (elapsed / done) * (steps_total - done))
+        for i, job in enumerate(jobs):
+            extra = {"step_s": step_s[-1], "step_mode": mode} if i == 0 else {}
+            reports[job.id](current=current, eta_seconds=eta, preview=_latent_preview(latents, i), **extra)
+        logger.info("denoise step %d/%d — %.0f ms (batch=%d)", current, steps_total, step_ms, len(jobs))
+        stops = poll()
+        if all(job.id in stops for job in jobs):
+            raise JobInterrupted(f"stopped after step {current}/{steps_total}")
+        return callback_kwargs
+
+    logger.info("Running AnimateDiff... frames=%s steps=%s denoise=%s cfg=%s mode=%s batch=%d",
+                p["frames"], p["steps"], p["denoise_strength"], p["cfg"], mode, len(jobs))
+    # denoise to latents, then decode ourselves, so each stage is timed on its own
+    with torch.inference_mode(), _inference_mode(pipe, mode):
+        with _context_window(pipe, p["frames"], p.get("loop", False)):
+            latents = pipe(callback_on_step_end=_on_step, callback_on_step_end_tensor_inputs=["latents"],
+                           output_type="latent", **pipe_kwargs).frames
+        t_denoised = time.time()
+        video = pipe.video_processor.postprocess_video(video=pipe.decode_latents(latents), output_type="pil")
+    stages["denoise"] = t_denoised - t0
+    stages["vae_decode"] = time.time() - t_denoised
+
+    errors: Dict[str, Optional[BaseException]] = {}
+    for job, sample, frames_out in zip(jobs, samples, video):
+        kind = poll().get(job.id)
+        if kind is not None:
+            errors[job.id] = _interruption(kind)
+            continue
+        reports[job.id](current=steps_total, eta_seconds=3.0)
+        try:
+            np_frames = _timed((np.asarray(fr.convert("RGB"), dtype=np.uint8) for fr in frames_out),
+                               stages, "to_numpy")
+            if sample["box"] is not None:
+                np_frames = _paste_crop(sample["still"], sample["box"], np_frames)
+            factor, _, out_fps = output_timing(job.params)
+            if factor > 1:
+                mask = sky_mask(np.asarray(sample["still"], dtype=np.uint8))
+                np_frames = interpolate_frames(np_frames, factor, mask, loop=job.params.get("loop", False))
+            if job.params.get("output_side"):
+                np_frames = _composite_frames(job, sample["still"], np_frames)
+            np_frames = _timed(np_frames, stages, "frames")
+            stats = write_mp4(np_frames, Path(job.video_path), out_fps, job.params.get("encode_profile"))
+            stages["mp4_encode"] = stages.get("mp4_encode", 0.0) + stats.encode_s
+            reports[job.id](encode=stats.as_meta())
+            errors[job.id] = None
+        except Exception as e:
+            logger.exception("Encoding job %s failed: %s", job.id, e)
+            errors[job.id] = e
+
+    # profiler overhead would skew the cost model
+    if step_s and not p.get("profile"):
+        per_step = statistics.median(step_s)
+        reports[jobs[0].id](timing=dict(
+            mode=mode, threads=torch.get_num_threads(),
+            frames=p["frames"], width=img.width, height=img.height, batch=len(jobs),
+            step_s=per_step,
+            overhead_s=max(0.0, (time.time() - t_start) - per_step * len(step_s)),
+        ))
+    # paste/interpolate/composite is what the frame generator spends beyond PIL -> numpy
+    frames_s = stages.pop("frames", 0.0)
+    stages["postprocess"] = max(0.0, frames_s - stages.get("to_numpy", 0.0))
+    reports[jobs[0].id](stages=stages)
+    return errors
+
+def _op_rows(events, limit: int, stack_depth: int = 0) -> List[Dict]:
+    """The ``limit`` most expensive ops by self CPU time, as JSON rows."""
+    rows = []
+    for e in sorted(events, key=lambda e: e.self_cpu_time_total, reverse=True)[:limit]:
+        row = {
+            "op": e.key,
+            "calls": e.count,
+            "self_cpu_ms": e.self_cpu_time_total / 1000.0,
+            "cpu_ms": e.cpu_time_total / 1000.0,
+            "self_cpu_mem_mb": e.self_cpu_memory_usage / (1024.0 * 1024.0),
+        }
+        if stack_depth:
+            row["stack"] = list(e.stack[:stack_depth])
+        rows.append(row)
+    return rows
+
+def _write_profile(prof, jobs: List[Job], wall_s: float) -> None:
+    """Top-operator summary, Chrome trace and Python stacks into each job's directory."""
+    summary = {
+        "jobs": [job.id for job in jobs],
+        "wall_s": wall_s,
+        "threads": torch.get_num_threads(),
+        "interop_threads": torch.get_num_interop_threads(),
+        "cpu_affinity": sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else None,
+        "params": jobs[0].params,
+        "top_ops": _op_rows(prof.key_averages(), PROFILE_TOP_OPS),
+        # the same ops split by the Python line that issued them (attention vs VAE vs motion module)
+        "top_ops_by_stack": _op_rows(prof.key_averages(group_by_stack_n=8), PROFILE_TOP_OPS, stack_depth=8),
+        "trace": "profile_trace.json",
+        "stacks": "profile_stacks.txt",
+    }
+    first = Path(jobs[0].job_dir)
+    prof.export_chrome_trace(str(first / summary["trace"]))
+    prof.export_stacks(str(first / summary["stacks"]), "self_cpu_time_total")
+    for job in jobs:
+        out = Path(job.job_dir)
+        if out != first:
+            for name in (summary["trace"], summary["stacks"]):
+                shutil.copyfile(first / name, out / name)
+        with (out / PROFILE_SUMMARY).open("w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2)
+
+@contextmanager
+def _profiled(jobs: List[Job]):
+    """``torch.profiler`` around the run when the jobs asked for it (batch keys keep them together)."""
+    if not jobs[0].params.get("profile"):
+        yield
+        return
+    from torch.profiler import ProfilerActivity, profile
+
+    prof = profile(activities=[ProfilerActivity.CPU], record_shapes=True, profile_memory=True, with_stack=True)
+    t0 = time.time()
+    prof.start()
+    try:
+        yield
+    finally:
+        prof.stop()
+        try:
+            _write_profile(prof, jobs, time.time() - t0)
+        except Exception as e:
+            logger.warning("Failed to write profile for %s: %s", jobs[0].id, e)
+
+def run_batch(jobs: List[Job], reports: Dict[str, Report],
+              poll: Poll = _no_stops) -> Dict[str, Optional[BaseException]]:
+    """Run compatible jobs as one batched denoise; returns each job's error (or None).
+
+    If the batched call itself fails, the jobs are retried one at a time so a
+    single bad input cannot fail its batch-mates. Jobs stopped through ``poll``
+    come back as ``JobCancelled``/``JobPreempted``.
+    """
+    errors: Dict[str, Optional[BaseException]] = {}
+    stops = poll()
+    for job in jobs:
+        if job.id in stops:
+            errors[job.id] = _interruption(stops[job.id])
+    jobs = [job for job in jobs if job.id not in errors]
+    if not jobs:
+        return errors
+
+    pipe = ModelManager.get_pipe()
+    with _profiled(jobs):
+        return _run_batch(pipe, jobs, reports, poll, errors)
+
+def _run_batch(pipe, jobs: List[Job], reports: Dict[str, Report], poll: Poll,
+               errors: Dict[str, Optional[BaseException]]) -> Dict[str, Optional[BaseException]]:
+    if len(jobs) > 1:
+        try:
+            errors.update(_denoise_and_encode(pipe, jobs, reports, poll))
+            return errors
+        except JobInterrupted:
+            stops = poll()
+            errors.update({job.id: _interruption(stops[job.id]) for job in jobs})
+            return errors
+        except Exception as e:
+            logger.warning("Batched run of %d jobs failed (%s); running them one by one", len(jobs), e)
+
+    for job in jobs:
+        kind = poll().get(job.id)
+        if kind is not None:
+            errors[job.id] = _interruption(kind)
+            continue
+        try:
+            errors.update(_denoise_and_encode(pipe, [job], reports, poll))
+        except JobInterrupted:
+            errors[job.id] = _interruption(poll()[job.id])
+        except Exception as e:
+            logger.exception("Pipeline failed: %s", e)
+            errors[job.id] = e
+    return errors
+
+def run_job(job: Job, report: Report) -> None:
+    """Denoise and encode one job; progress goes out through ``report(**fields)``."""
+    err = run_batch([job], {job.id: report})[job.id]
+    if err is not None:
+        raise err
+
+def model_loaded() -> bool:
+    return ModelManager._loaded
+
+def model_memory() -> Dict[str, int]:
+    """Bytes of pipeline weights (parameters and buffers) and how many are memory-mapped."""
+    pipe = ModelManager._pipe
+    if pipe is None:
+        return {"weights_bytes": 0, "mapped_bytes": 0}
+    seen = set()
+    total = mapped = 0
+    modules = [pipe.unet, pipe.vae, pipe.text_encoder, *ModelManager._unets.values()]
+    for module in modules:
+        for t in (*module.parameters(), *module.buffers()):
+            ptr = t.data_ptr()
+            if ptr in seen:
+                continue
+            seen.add(ptr)
+            size = t.numel() * t.element_size()
+            total += size
+            if ptr in ModelManager._mapped:
+                mapped += size
+    return {"weights_bytes": total, "mapped_bytes": mapped}
@@ -1,23 +1,20 @@
 
 from __future__ import annotations
-import io, os, time, json, uuid, threading, queue
+import asyncio, io, os, time, json, uuid, threading, queue, traceback, hashlib, itertools, functools
+import multiprocessing as mp
 from dataclasses import dataclass, asdict
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple
 from pathlib import Path
 
+import logging
 import numpy as np
 from PIL import Image
-import torch
-import logging
-
-from app.services.encode import write_mp4
 
-from diffusers import AnimateDiffVideoToVideoPipeline, MotionAdapter, LCMScheduler
-from diffusers.utils.logging import set_verbosity_info as df_set_info
-import transformers
+from app.services import metrics
+from app.services.cost_model import CostModel
+from app.services.encode import resolve_profile
+from app.services.job_store import JobStore
 
-df_set_info()
-transformers.utils.logging.set_verbosity_error()
 logger = logging.getLogger("i2v_worker")
 if not logger.handlers:
     h = logging.StreamHandler()
@@ -31,7 +28,60 @@ OUTPUTS_ROOT = APP_DIR / "data" / "outputs"
 DATA_DIR = Path(os.getenv("DATA_DIR", OUTPUTS_ROOT / "jobs"))
 DATA_DIR.mkdir(parents=True, exist_ok=True)
 
-MAX_QUEUE = int(os.getenv("MAX_QUEUE", "2"))
+JOB_DB_PATH = Path(os.getenv("JOB_DB_PATH", DATA_DIR / "jobs.sqlite3"))
+COST_MODEL_PATH = Path(os.getenv("COST_MODEL_PATH", DATA_DIR / "cost_model.json"))
+
+# Admission: reject when the estimated wait for a new job exceeds I2V_MAX_BACKLOG_S.
+# Setting MAX_QUEUE explicitly keeps the old "N queued while all workers busy" rule.
+MAX_QUEUE = int(os.getenv("MAX_QUEUE", "0"))
+I2V_MAX_BACKLOG_S = float(os.getenv("I2V_MAX_BACKLOG_S", "1800"))
+I2V_WORKERS = max(1, int(os.getenv("I2V_WORKERS", "1")))
+I2V_MAX_BATCH = max(1, int(os.getenv("I2V_MAX_BATCH", "4")))
+I2V_BATCH_WINDOW_S = float(os.getenv("I2V_BATCH_WINDOW_S", "2.0"))
+I2V_PREEMPT = os.getenv("I2V_PREEMPT", "0") == "1"
+
+TERMINAL = ("done", "failed", "cancelled")
+
+MOTION_ADAPTER_ID = os.getenv("MOTION_ADAPTER_ID", "guoyww/animatediff-motion-adapter-v1-5")
+BASE_MODEL_ID     = os.getenv("BASE_MODEL_ID", "runwayml/stable-diffusion-v1-5")
+LCM_REPO          = os.getenv("LCM_REPO", "wangfuyun/AnimateLCM-I2V")
+LCM_WEIGHT_NAME   = os.getenv("LCM_WEIGHT_NAME", "AnimateLCM_sd15_i2v_lora.safetensors")
+LCM_LORA_WEIGHT   = float(os.getenv("LCM_LORA_WEIGHT", "0.8"))
+
+# fp32: reference; bf16: CPU autocast; int8: dynamic-quantized Linear layers;
+# compile: torch.compile'd UNet (warmed up when the worker starts)
+INFERENCE_MODES = ("fp32", "bf16", "int8", "compile")
+I2V_MODE = os.getenv("I2V_MODE", "fp32")
+I2V_WARMUP = os.getenv("I2V_WARMUP", "0") == "1" or I2V_MODE == "compile"
+# Spawn the workers at API startup and load the pipeline there, instead of on the first job.
+I2V_PRELOAD = os.getenv("I2V_PRELOAD", "0") == "1" or I2V_WARMUP
+# A worker with no job for this long drops its pipeline (0 keeps it resident). Warmed-up
+# workers (I2V_WARMUP, compile mode) keep theirs: a reload would make the next job recompile.
+I2V_IDLE_UNLOAD_S = float(os.getenv("I2V_IDLE_UNLOAD_S", "900"))
+# Build the models empty and point their weights at copy-on-write maps of the cached
+# safetensors files: no private copy, shared by all workers, reloads from the page cache.
+I2V_MMAP_WEIGHTS = os.getenv("I2V_MMAP_WEIGHTS", "1") == "1"
+I2V_CALIBRATE = os.getenv("I2V_CALIBRATE", "0") == "1"
+# Request defaults; warm-up compiles for this shape so the common job does not recompile.
+I2V_DEFAULT_FRAMES = int(os.getenv("I2V_DEFAULT_FRAMES", "20"))
+I2V_DEFAULT_MAX_SIDE = int(os.getenv("I2V_DEFAULT_MAX_SIDE", "320"))
+# Warm-up frame size as WxH (default: 16:9 at the default max_side, latent-aligned)
+I2V_WARMUP_SIZE = os.getenv("I2V_WARMUP_SIZE", "")
+
+# Clips longer than I2V_CONTEXT_FRAMES are denoised in overlapping windows of that
+# size (the motion module's training length), so UNet memory does not grow with length.
+I2V_CONTEXT_FRAMES = int(os.getenv("I2V_CONTEXT_FRAMES", "16"))
+I2V_CONTEXT_OVERLAP = int(os.getenv("I2V_CONTEXT_OVERLAP", "4"))
+I2V_MAX_FRAMES = int(os.getenv("I2V_MAX_FRAMES", "120"))
+# Upper bound for ``output_side``: low-res sky motion composited onto the full-res still.
+I2V_MAX_OUTPUT_SIDE = int(os.getenv("I2V_MAX_OUTPUT_SIDE", "2560"))
+# ``sky_crop`` jobs denoise only the sky's bounding box, padded by this many (low-res) pixels.
+I2V_SKY_CROP_PAD = int(os.getenv("I2V_SKY_CROP_PAD", "16"))
+# ``output_fps`` above ``fps`` is reached by interpolating between the denoised keyframes.
+I2V_MAX_OUTPUT_FPS = int(os.getenv("I2V_MAX_OUTPUT_FPS", "30"))
+# Profile every job with torch.profiler (per-job ``profile`` overrides); traces land in the job dir.
+I2V_PROFILE = os.getenv("I2V_PROFILE", "0") == "1"
+PROFILE_SUMMARY = "profile.json"
 
 PROMPT_DEFAULT = (
     "camera locked, static architecture, building unchanged, sharp straight edges; "
@@ -44,14 +94,6 @@ NEG_PROMPT_DEFAULT = (
     "moving shadows on building, ghosting, flicker, motion blur, rain, fog, birds, people, cars, text, watermark, logo, low quality"
 )
 
-def _init_threads():
-    default_threads = max(1, min(os.cpu_count() or 4, 6))
-    os.environ.setdefault("OMP_NUM_THREADS", str(default_threads))
-    os.environ.setdefault("MKL_NUM_THREADS", str(default_threads))
-    torch.set_num_threads(int(os.environ.get("TORCH_NUM_THREADS", default_threads)))
-    torch.set_num_interop_threads(int(os.environ.get("TORCH_NUM_INTEROP", 1)))
-_init_threads()
-
 @dataclass
 class Job:
     id: str
@@ -67,6 +109,31 @@ class Job:
     job_dir: str = ""
     input_path: str = ""
     video_path: str = ""
+    cache_key: Optional[str] = None
+    batch_key: Optional[str] = None
+    priority: int = 0
+    encode: Optional[Dict] = None
+    # identical seeded requests share one job; it is only cancelled once all of them cancel
+    requesters: int = 1
+
+class JobInterrupted(Exception):
+    """Raised between denoise steps when a job is told to stop."""
+    status = "failed"
+
+class JobCancelled(JobInterrupted):
+    status = "cancelled"
+
+class JobPreempted(JobInterrupted):
+    status = "queued"
+
+def job_event(job: Job) -> Dict:
+    """Client-facing status snapshot, shared by /svd/status and the event stream."""
+    return {
+        "job_id": job.id,
+        "status": job.status,
+        "progress": {"current": job.current, "total": job.total, "eta_seconds": job.eta_seconds},
+        "error": job.error,
+    }
 
 def _write_meta(job: Job) -> None:
     try:
@@ -76,202 +143,662 @@ def _write_meta(job: Job) -> None:
     except Exception as e:
         logger.warning("Failed to write meta.json: %s", e)
 
-class ModelManager:
-    _lock = threading.Lock()
-    _pipe: Optional[AnimateDiffVideoToVideoPipeline] = None
-    _loaded = False
-
-    @classmethod
-    def get_pipe(cls) -> AnimateDiffVideoToVideoPipeline:
-        with cls._lock:
-            if cls._pipe is None:
-                cls._pipe = cls._load_pipeline()
-                cls._loaded = True
-            return cls._pipe
-
-    @staticmethod
-    def _load_pipeline() -> AnimateDiffVideoToVideoPipeline:
-        motion_adapter_id = os.getenv("MOTION_ADAPTER_ID", "guoyww/animatediff-motion-adapter-v1-5")
-        base_model_id    = os.getenv("BASE_MODEL_ID", "runwayml/stable-diffusion-v1-5")
-        lcm_repo         = os.getenv("LCM_REPO", "wangfuyun/AnimateLCM-I2V")
-        lcm_weight_name  = os.getenv("LCM_WEIGHT_NAME", "AnimateLCM_sd15_i2v_lora.safetensors")
-        lcm_weight       = float(os.getenv("LCM_LORA_WEIGHT", "0.8"))
-
-        adapter = MotionAdapter.from_pretrained(motion_adapter_id)
-        pipe = AnimateDiffVideoToVideoPipeline.from_pretrained(
-            base_model_id,
-            motion_adapter=adapter
-        )
+def _cache_key(file_bytes: bytes, params: Dict) -> Optional[str]:
+    """Content address of a request, or None when the output is not reproducible."""
+    if params.get("seed") is None:
+        return None
+    h = hashlib.sha256()
+    h.update(hashlib.sha256(file_bytes).digest())
+    h.update(json.dumps(params, sort_keys=True).encode("utf-8"))
+    h.update(json.dumps(
+        [MOTION_ADAPTER_ID, BASE_MODEL_ID, LCM_REPO, LCM_WEIGHT_NAME, LCM_LORA_WEIGHT]
+    ).encode("utf-8"))
+    return h.hexdigest()
+
+def _resized_size(w: int, h: int, max_side: int) -> Tuple[int, int]:
+    """Size a ``w`` x ``h`` image is resized to: long side pinned to ``max_side``, never upscaled."""
+    if max(w, h) <= max_side:
+        return w, h
+    if w >= h:
+        return max_side, int(h * (max_side / w))
+    return int(w * (max_side / h)), max_side
 
-        pipe.scheduler = LCMScheduler.from_config(pipe.scheduler.config, beta_schedule="linear")
+def _load_and_resize_image(data: bytes, max_side: int) -> Image.Image:
+    img = Image.open(io.BytesIO(data)).convert("RGB")
+    size = _resized_size(*img.size, max_side)
+    if size != img.size:
+        img = img.resize(size, Image.LANCZOS)
+    return img
 
-        try:
-            pipe.load_lora_weights(lcm_repo, weight_name=lcm_weight_name, adapter_name="lcm-lora")
-            pipe.set_adapters(["lcm-lora"], [lcm_weight])
-            logger.info("Loaded AnimateLCM LoRA '%s' (weight=%.2f)", lcm_weight_name, lcm_weight)
-        except Exception as e:
-            logger.warning("AnimateLCM LoRA not loaded: %s", e)
+# /proc/cpuinfo flags oneDNN runs bf16 with: native bf16/AMX, or AVX-512 (BW+VL+DQ) emulation
+_BF16_NATIVE_FLAGS = {"avx512_bf16", "amx_bf16", "bf16"}
+_BF16_AVX512_FLAGS = {"avx512bw", "avx512vl", "avx512dq"}
 
-        pipe.enable_attention_slicing()
-        pipe.enable_vae_slicing()
-        pipe.enable_vae_tiling()
+@functools.lru_cache(maxsize=1)
+def _bf16_supported() -> bool:
+    """Whether bf16 autocast is usable here, read from /proc/cpuinfo so the API needs no torch."""
+    try:
+        with open("/proc/cpuinfo") as f:
+            flags = {
+                word for line in f if line.startswith(("flags", "Features"))
+                for word in line.split(":", 1)[1].split()
+            }
+    except (OSError, IndexError):
+        return False
+    return bool(flags & _BF16_NATIVE_FLAGS) or _BF16_AVX512_FLAGS <= flags
+
+def resolve_mode(mode: Optional[str]) -> str:
+    """Inference mode a job actually runs in: the request's (or ``I2V_MODE``), else fp32."""
+    mode = mode or I2V_MODE
+    if mode not in INFERENCE_MODES:
+        logger.warning("Unknown inference mode '%s'; using fp32", mode)
+        return "fp32"
+    if mode == "bf16" and not _bf16_supported():
+        logger.warning("CPU lacks bf16 support; using fp32")
+        return "fp32"
+    return mode
+
+def denoise_steps(params: Dict) -> int:
+    """Steps the pipeline actually runs: img2img starts ``denoise_strength`` into the schedule."""
+    steps = int(params["steps"])
+    return max(1, min(steps, int(steps * params["denoise_strength"])))
+
+def output_timing(params: Dict) -> Tuple[int, int, int]:
+    """``(factor, frames, fps)`` of the encoded clip; ``factor`` frames per denoised keyframe."""
+    fps = params["fps"]
+    factor = max(1, round((params.get("output_fps") or fps) / fps))
+    keyframes = params["frames"]
+    frames = keyframes * factor if params.get("loop") else (keyframes - 1) * factor + 1
+    return factor, frames, fps * factor
+
+def _sky_crop(img: Image.Image) -> Optional[tuple]:
+    """Latent-aligned sky box of a resized still (sides already multiples of 8), or None."""
+    from app.services.sky_anim import sky_crop_box  # imageio and friends; only sky_crop jobs need it
+    return sky_crop_box(np.asarray(img), multiple=8, pad_px=I2V_SKY_CROP_PAD)
+
+def _batch_key(file_bytes: bytes, params: Dict) -> str:
+    """Jobs with equal keys can share one denoise: same latent shape and schedule.
+
+    ``denoise_strength`` is part of the key because it picks the scheduler's
+    starting timestep, which a batch shares. For ``sky_crop`` jobs the shape is
+    the crop's, which needs the resized still rather than just its header.
+    """
+    if params.get("sky_crop"):
+        img = _load_and_resize_image(file_bytes, params["max_side"])
+        img = img.crop((0, 0, img.width - img.width % 8, img.height - img.height % 8))
+        box = _sky_crop(img) or (0, 0, img.width, img.height)
+        w, h = box[2] - box[0], box[3] - box[1]
+    else:
+        w, h = _resized_size(*Image.open(io.BytesIO(file_bytes)).size, params["max_side"])
+    return json.dumps([
+        w - w % 8, h - h % 8, params["frames"], params["steps"],
+        params["cfg"], params["denoise_strength"], params["mode"], params.get("loop", False),
+        params.get("sky_crop", False), params.get("profile", False),
+    ])
+
+def _core_slices(workers: int) -> List[List[int]]:
+    """Split the cores this process may use into disjoint slices, one per worker.
+
+    Never oversubscribes: ``workers`` is clamped to the core count, and an
+    ``I2V_THREADS_PER_WORKER`` that does not fit falls back to an even split.
+    """
+    try:
+        cores = sorted(os.sched_getaffinity(0))
+    except AttributeError:
+        cores = list(range(os.cpu_count() or 1))
+    if workers > len(cores):
+        logger.warning("I2V_WORKERS=%d exceeds the %d available cores; starting %d workers",
+                       workers, len(cores), len(cores))
+        workers = len(cores)
+    fair = len(cores) // workers
+    per = int(os.getenv("I2V_THREADS_PER_WORKER", "0")) or fair
+    if per > fair:
+        logger.warning("I2V_THREADS_PER_WORKER=%d x %d workers exceeds %d cores; using %d per worker",
+                       per, workers, len(cores), fair)
+        per = fair
+    return [cores[i * per:(i + 1) * per] for i in range(workers)]
+
+def _remove_outputs(job: Job) -> None:
+    """Drop a cancelled job's input and any partial video; meta.json stays."""
+    for path in (job.input_path, job.video_path):
         try:
-            pipe.unet.to(memory_format=torch.channels_last)
-            pipe.vae.to(memory_format=torch.channels_last)
-        except Exception:
+            os.remove(path)
+        except OSError:
             pass
 
-        pipe.set_progress_bar_config(disable=False)
-        pipe.to("cpu")
-        return pipe
+def _worker_main(idx: int, cores: List[int], tasks, control, events) -> None:
+    """Entry point of an inference process: pin, size thread pools, then serve jobs."""
+    try:
+        os.sched_setaffinity(0, cores)
+    except (AttributeError, OSError):
+        pass
+    for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "TORCH_NUM_THREADS"):
+        os.environ[var] = str(len(cores))
+
+    # torch reads the thread env vars at import, so only import it now
+    from app.services import i2v_inference
+    i2v_inference._init_threads(len(cores))
+    logger.info("i2v worker %d up (pid=%d, cores=%s)", idx, os.getpid(), cores)
+
+    if I2V_WARMUP:
+        i2v_inference.warmup(I2V_MODE)
+    elif I2V_PRELOAD:
+        i2v_inference.ModelManager.get_pipe()
+    # one report is enough; the other workers would only overwrite it
+    if I2V_CALIBRATE and idx == 0:
+        events.put((idx, None, {"mode_report": i2v_inference.calibrate_modes()}))
+    load_s = i2v_inference.ModelManager.pop_load_seconds()
+    events.put((idx, None, {
+        "model_loaded": i2v_inference.model_loaded(), "idle": True,
+        "model_memory": i2v_inference.model_memory(),
+        "stages": {"model_load": load_s} if load_s is not None else {},
+    }))
+
+    # job id -> "cancel" | "preempt", fed by the API process over ``control``
+    stops: Dict[str, str] = {}
+
+    def poll() -> Dict[str, str]:
+        while True:
+            try:
+                kind, job_id = control.get_nowait()
+            except queue.Empty:
+                return stops
+            # a cancel is final; a later preempt must not turn it back into a re-queue
+            if stops.get(job_id) != "cancel":
+                stops[job_id] = kind
+
+    while True:
+        unloadable = I2V_IDLE_UNLOAD_S > 0 and not I2V_WARMUP and i2v_inference.model_loaded()
+        idle_ttl = I2V_IDLE_UNLOAD_S if unloadable else None
+        try:
+            batch = tasks.get(timeout=idle_ttl)
+        except queue.Empty:
+            logger.info("i2v worker %d idle for %.0fs; unloading the pipeline", idx, idle_ttl)
+            i2v_inference.ModelManager.unload()
+            events.put((idx, None, {"model_loaded": False, "model_memory": i2v_inference.model_memory()}))
+            continue
+        if batch is None:
+            return
 
-def _load_and_resize_image(data: bytes, max_side: int) -> Image.Image:
-    img = Image.open(io.BytesIO(data)).convert("RGB")
-    w, h = img.size
-    if max(w, h) > max_side:
-        if w >= h:
-            new_w = max_side
-            new_h = int(h * (max_side / w))
-        else:
-            new_h = max_side
-            new_w = int(w * (max_side / h))
-        img = img.resize((new_w, new_h), Image.LANCZOS)
-    return img
+        reports = {
+            job.id: (lambda _id: lambda **fields: events.put((idx, _id, fields)))(job.id)
+            for job in batch
+        }
+        for job in batch:
+            reports[job.id](status="running", started_ts=time.time())
+        try:
+            errors = i2v_inference.run_batch(batch, reports, poll)
+        except Exception as e:
+            logger.exception("Pipeline failed: %s", e)
+            errors = {job.id: e for job in batch}
+        for job in batch:
+            e = errors.get(job.id)
+            stops.pop(job.id, None)
+            if e is None:
+                reports[job.id](status="done", finished_ts=time.time(), current=job.total, eta_seconds=0.0)
+            elif isinstance(e, JobPreempted):
+                reports[job.id](status="queued", started_ts=None, current=0, eta_seconds=None)
+            elif isinstance(e, JobInterrupted):
+                reports[job.id](status=e.status, finished_ts=time.time())
+            else:
+                tb = "".join(traceback.format_exception(type(e), e, e.__traceback__))
+                reports[job.id](status="failed", finished_ts=time.time(),
+                                error=f"{e.__class__.__name__}: {e}\n{tb}")
+        events.put((idx, None, {
+            "model_loaded": i2v_inference.model_loaded(), "idle": True,
+            "model_memory": i2v_inference.model_memory(),
+        }))
+
+class _WorkerSlot:
+    def __init__(self, idx: int, cores: List[int]):
+        self.idx = idx
+        self.cores = cores
+        self.proc = None
+        self.tasks = None
+        self.control = None
+        self.job_ids: List[str] = []
+        self.ready = False
+        self.preempting = False
+        self.model_loaded = False
+        self.model_memory: Dict[str, int] = {}
 
 class JobQueue:
-    def __init__(self):
-        self.q: "queue.Queue[str]" = queue.Queue()
+    """Job table in the API process in front of a pool of inference processes.
+
+    Each worker process owns its own pipeline and a disjoint slice of CPU cores.
+    A dispatcher thread hands queued jobs to idle workers; a collector thread
+    applies the state/progress updates workers send back over a shared queue.
+
+    Every job is persisted in a ``JobStore``; only queued and running jobs are
+    also kept in ``self.jobs``, finished ones are served from the store.
+    """
+
+    def __init__(self, workers: int = I2V_WORKERS):
+        # (-priority, created_ts, seq, job_id): highest priority first, then FIFO
+        self.q: "queue.PriorityQueue[tuple]" = queue.PriorityQueue()
+        self._seq = itertools.count()
         self.jobs: Dict[str, Job] = {}
         self.lock = threading.Lock()
-        self.worker = threading.Thread(target=self._loop, daemon=True)
-        self.worker.start()
-
-    def put(self, job: Job):
+        self.slots = [_WorkerSlot(i, c) for i, c in enumerate(_core_slices(workers))]
+        self.idle: "queue.Queue[int]" = queue.Queue()
+        self.mode_report: Optional[Dict] = None
+        self._ctx = mp.get_context("spawn")
+        self._events = None
+        self._started = False
+        self._tickers: Dict[str, threading.Event] = {}
+        self._subscribers: Dict[str, List[tuple]] = {}
+        self._eta_marks: Dict[str, tuple] = {}
+        self._store: Optional[JobStore] = None
+        self._cost: Optional[CostModel] = None
+        self.admit_lock = threading.Lock()
+
+    @property
+    def store(self) -> JobStore:
+        # opened on first use so importing this module in worker processes stays cheap
         with self.lock:
-            self.jobs[job.id] = job
-        self.q.put(job.id)
+            if self._store is None:
+                self._store = JobStore(JOB_DB_PATH, Job)
+            return self._store
 
-    def get(self, job_id: str) -> Optional[Job]:
+    @property
+    def cost(self) -> CostModel:
         with self.lock:
-            return self.jobs.get(job_id)
+            if self._cost is None:
+                self._cost = CostModel(COST_MODEL_PATH)
+            return self._cost
 
-    def _estimate_total_seconds(self, steps: int, max_side: int) -> float:
-        base_s_per_step = 3.5
-        scale_res = (max_side / 320.0) ** 2
-        return max(1.0, steps * base_s_per_step * max(0.5, scale_res))
+    @property
+    def workers(self) -> int:
+        return len(self.slots)
 
-    def _loop(self):
-        while True:
-            job_id = self.q.get()
-            job = self.get(job_id)
-            if not job:
-                continue
+    def _ensure_started(self):
+        with self.lock:
+            if self._started:
+                return
+            self._started = True
+        self._events = self._ctx.Queue()
+        for slot in self.slots:
+            self._spawn(slot)
+        threading.Thread(target=self._loop, daemon=True).start()
+        threading.Thread(target=self._collect, daemon=True).start()
+
+    def _spawn(self, slot: _WorkerSlot):
+        slot.tasks = self._ctx.Queue()
+        slot.control = self._ctx.Queue()
+        slot.proc = self._ctx.Process(
+            target=_worker_main,
+            args=(slot.idx, slot.cores, slot.tasks, slot.control, self._events),
+            name=f"i2v-worker-{slot.idx}",
+            daemon=True,
+        )
+        slot.proc.start()
+        slot.job_ids = []
+        slot.ready = False
+        slot.preempting = False
+
+    def put(self, job: Job):
+        self._ensure_started()
+        self.store.upsert(job)
+        with self.lock:
+            self.jobs[job.id] = job
+        self._enqueue(job)
+        self._maybe_preempt(job)
 
-            job.status = "running"
-            job.started_ts = time.time()
-            _write_meta(job)
+    def _enqueue(self, job: Job):
+        self.q.put((-job.priority, job.created_ts, next(self._seq), job.id))
 
-            est_total = self._estimate_total_seconds(job.total or 1, job.params["max_side"])
-            stop_evt = threading.Event()
+    def queued_eta(self, job: Job) -> float:
+        return self.backlog_seconds(before=job) + self.estimate_seconds(job)
 
-            def _tick():
-                while not stop_evt.is_set():
-                    elapsed = time.time() - (job.started_ts or time.time())
-                    job.eta_seconds = max(0.0, est_total - elapsed)
-                    time.sleep(1.0)
+    def get(self, job_id: str) -> Optional[Job]:
+        with self.lock:
+            job = self.jobs.get(job_id)
+        if job is None:
+            return self.store.get(job_id)
+        if job.status == "queued":
+            job.eta_seconds = self.queued_eta(job)
+        return job
+
+    def count(self, status: str) -> int:
+        return self.store.count(status)
+
+    def find_cached(self, cache_key: str) -> Optional[Job]:
+        """A finished job with a usable output, or an in-flight one, for ``cache_key``."""
+        for job in self.store.by_cache_key(cache_key, ("queued", "running", "done")):
+            if job.status != "done":
+                with self.lock:
+                    return self.jobs.get(job.id, job)
+            if os.path.exists(job.video_path):
+                return job
+        return None
+
+    def _persist(self, job: Job, preview: Optional[str] = None):
+        self.store.upsert(job)
+        _write_meta(job)
+        if job.status in TERMINAL:
+            with self.lock:
+                self.jobs.pop(job.id, None)
+        self._publish(job, preview)
+
+    def subscribe(self, job_id: str, loop) -> "asyncio.Queue":
+        """asyncio queue on ``loop`` that receives every state/progress change of ``job_id``."""
+        q = asyncio.Queue()
+        with self.lock:
+            self._subscribers.setdefault(job_id, []).append((loop, q))
+        return q
 
-            t = threading.Thread(target=_tick, daemon=True)
-            t.start()
+    def unsubscribe(self, job_id: str, q) -> None:
+        with self.lock:
+            subs = [s for s in self._subscribers.get(job_id, []) if s[1] is not q]
+            if subs:
+                self._subscribers[job_id] = subs
+            else:
+                self._subscribers.pop(job_id, None)
 
+    def _publish(self, job: Job, preview: Optional[str] = None):
+        with self.lock:
+            subs = list(self._subscribers.get(job.id, ()))
+        if not subs:
+            return
+        event = job_event(job)
+        if preview is not None:
+            event["preview"] = preview
+        for loop, q in subs:
             try:
-                self._run_job(job)
-                job.status = "done"
-                job.finished_ts = time.time()
-                job.current = job.total
-                job.eta_seconds = 0.0
-                _write_meta(job)
-            except Exception as e:
-                job.status = "failed"
-                job.error = str(e)
-                job.finished_ts = time.time()
-                _write_meta(job)
-            finally:
-                stop_evt.set()
-                t.join(timeout=0.1)
-                self.q.task_done()
-
-    def _run_job(self, job: Job):
-        pipe = ModelManager.get_pipe()
+                loop.call_soon_threadsafe(q.put_nowait, event)
+            except RuntimeError:
+                pass  # subscriber's loop already closed
+
+    def recover(self):
+        """Re-enqueue jobs left queued by a previous process; fail the ones it was running."""
+        for job in self.store.by_status("cancelling"):
+            job.status = "cancelled"
+            job.finished_ts = time.time()
+            _remove_outputs(job)
+            self._persist(job)
+        for job in self.store.by_status("running"):
+            job.status = "failed"
+            job.error = "interrupted: server restarted while the job was running"
+            job.finished_ts = time.time()
+            self._persist(job)
+        pending = self.store.by_status("queued")
+        for job in pending:
+            self.put(job)
+        if pending:
+            logger.info("Re-enqueued %d queued job(s) from %s", len(pending), JOB_DB_PATH)
+
+    def estimate_seconds(self, job: Job) -> float:
+        """Predicted wall time of ``job`` on one worker, from the learned cost model."""
         p = job.params
+        if job.batch_key:
+            width, height = json.loads(job.batch_key)[:2]
+        else:
+            width = height = p["max_side"]
+        steps = denoise_steps(p)
+        threads = len(self.slots[0].cores) if self.slots else 1
+        return max(1.0, self.cost.job_seconds(p["mode"], threads, p["frames"], width, height, steps))
+
+    def _remaining_seconds(self, job: Job) -> float:
+        if job.eta_seconds is not None:
+            return job.eta_seconds
+        return self.estimate_seconds(job)
+
+    def backlog_seconds(self, before: Optional[Job] = None) -> float:
+        """Estimated wait until a worker frees up for a new job (or for ``before``)."""
+        with self.lock:
+            live = list(self.jobs.values())
+        running = [j for j in live if j.status == "running"]
+        queued = [j for j in live if j.status == "queued" and j is not before]
+        if before is not None:
+            rank = (-before.priority, before.created_ts)
+            queued = [j for j in queued if (-j.priority, j.created_ts) < rank]
+        total = sum(self._remaining_seconds(j) for j in running)
+        total += sum(self.estimate_seconds(j) for j in queued)
+        return total / max(1, self.workers)
+
+    def _take(self, timeout: Optional[float]) -> Optional[Job]:
+        """Highest-ranked still-queued job; None once ``timeout`` expires."""
+        while True:
+            try:
+                rank, _, _, job_id = self.q.get(timeout=timeout)
+            except queue.Empty:
+                return None
+            with self.lock:
+                job = self.jobs.get(job_id)
+            # entries left behind by a priority bump are stale; the re-ranked one wins
+            if job and job.status == "queued" and rank == -job.priority:
+                return job
+
+    def _gather(self, job: Job) -> List[Job]:
+        """``job`` plus compatible queued jobs arriving within the batch window.
+
+        Jobs already queued are taken without waiting. The window only stays open
+        once one of them was compatible, so a lone job dispatches at once instead
+        of holding the dispatcher (and every free worker) for the whole window.
+        """
+        batch = [job]
+        if I2V_MAX_BATCH <= 1 or not job.batch_key:
+            return batch
+        skipped: List[Job] = []
+        deadline = time.monotonic() + I2V_BATCH_WINDOW_S
+        while len(batch) < I2V_MAX_BATCH:
+            nxt = self._take(timeout=0)
+            if nxt is None and len(batch) > 1:
+                nxt = self._take(timeout=max(0.0, deadline - time.monotonic()))
+            if nxt is None:
+                break
+            if nxt.batch_key == job.batch_key:
+                batch.append(nxt)
+            else:
+                skipped.append(nxt)
+        # incompatible jobs go back with their original rank
+        for nxt in skipped:
+            self._enqueue(nxt)
+        return batch
+
+    def attach(self, job: Job, priority: int = 0) -> Job:
+        """Count one more requester on an in-flight job that a new request matched.
+
+        The shared job runs at the higher of the two priorities, so a queued one is
+        re-ranked and may preempt a lower batch just like a fresh submission.
+        """
+        with self.lock:
+            live = self.jobs.get(job.id)
+            if live is None or live.status not in ("queued", "running"):
+                return job
+            live.requesters += 1
+            raised = priority > live.priority
+            if raised:
+                live.priority = priority
+        self.store.upsert(live)
+        if raised and live.status == "queued":
+            self._enqueue(live)
+            self._maybe_preempt(live)
+        return live
+
+    def cancel(self, job_id: str) -> Optional[Job]:
+        """Cancel a queued job now, or ask its worker to stop it at the next step.
+
+        A job shared by several requesters only drops one of them until the last cancels.
+        """
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is not None and job.requesters > 1 and job.status in ("queued", "running"):
+                job.requesters -= 1
+                shared = True
+            else:
+                shared = False
+        if job is None:
+            return self.store.get(job_id)
+        if shared:
+            self.store.upsert(job)
+            logger.info("Job %s keeps running for %d other requester(s)", job.id, job.requesters)
+            return job
+        slot = next((s for s in self.slots if job_id in s.job_ids), None)
+        if slot is not None:
+            job.status = "cancelling"
+            slot.control.put(("cancel", job_id))
+            self._persist(job)
+        elif job.status == "queued":
+            job.status = "cancelled"
+            job.finished_ts = time.time()
+            _remove_outputs(job)
+            self._persist(job)
+        return job
 
-        with open(job.input_path, "rb") as f:
-            img = _load_and_resize_image(f.read(), p["max_side"])
-        frames_in: List[Image.Image] = [img.copy() for _ in range(p["frames"])]
-
-        generator = torch.Generator(device="cpu")
-        if p.get("seed") is not None:
-            generator = generator.manual_seed(int(p["seed"]))
-
-        steps_total = int(p["steps"])
-        job.total = steps_total
-
-        prompt_txt   = (p.get("prompt") or "").strip() or PROMPT_DEFAULT
-        negative_txt = (p.get("negative_prompt") or "").strip() or NEG_PROMPT_DEFAULT
-
-        pipe_kwargs = dict(
-            video=frames_in,
-            prompt=prompt_txt,
-            negative_prompt=negative_txt,
-            num_inference_steps=steps_total,
-            guidance_scale=p["cfg"],
-            strength=p["denoise_strength"],
-            generator=generator,
-        )
-
-        t0 = time.time()
-        last_t = t0
-        def _on_step(step_idx: int, timestep: int, latents):
-            nonlocal last_t
-            job.current = min(steps_total, step_idx + 1)
-            now = time.time()
-            step_ms = (now - last_t) * 1000.0
-            last_t = now
-            elapsed = now - t0
-            done = max(1, job.current)
-            job.eta_seconds = max(0.0, (elapsed / done) * (steps_total - done))
-            logger.info("denoise step %d/%d — %.0f ms", job.current, steps_total, step_ms)
-
-        try:
-            logger.info("Running AnimateDiff... frames=%s steps=%s denoise=%s cfg=%s",
-                        p["frames"], p["steps"], p["denoise_strength"], p["cfg"])
-            with torch.inference_mode():
-                try:
-                    out = pipe(callback=_on_step, callback_steps=1, **pipe_kwargs)
-                except TypeError:
-                    logger.info("Pipeline doesn't support callback; per-step progress disabled.")
-                    out = pipe(**pipe_kwargs)
-
-            frames_out: List[Image.Image] = out.frames[0]
+    def _maybe_preempt(self, job: Job):
+        """Stop the lowest-priority running batch if ``job`` outranks it and no worker is free."""
+        if not I2V_PREEMPT or any(s.ready and not s.job_ids for s in self.slots):
+            return
+        victim, floor = None, job.priority
+        for slot in self.slots:
+            if not slot.job_ids or slot.preempting:
+                continue
+            with self.lock:
+                live = [self.jobs[j] for j in slot.job_ids if j in self.jobs]
+            # a batch that is being cancelled frees its worker on its own
+            if any(j.status == "cancelling" for j in live):
+                continue
+            prios = [j.priority for j in live]
+            if prios and max(prios) < floor:
+                victim, floor = slot, max(prios)
+        if victim is not None:
+            logger.info("Preempting worker %d (priority %d) for job %s (priority %d)",
+                        victim.idx, floor, job.id, job.priority)
+            victim.preempting = True
+            for job_id in victim.job_ids:
+                victim.control.put(("preempt", job_id))
+
+    def _free_slot(self) -> _WorkerSlot:
+        while True:
+            slot = self.slots[self.idle.get()]
+            # skip stale entries left by a worker that died while idle
+            if slot.ready and slot.proc.is_alive():
+                return slot
 
-            job.current = steps_total
-            job.eta_seconds = 3.0
-            _write_meta(job)
+    def _loop(self):
+        # Take a worker first and only then the best queued job, so a job that
+        # arrives while every worker is busy still goes ahead of older, lower ones.
+        while True:
+            slot = self._free_slot()
+            job = self._take(timeout=None)
+            # jobs cancelled during the batch window are dropped here
+            batch = [j for j in self._gather(job) if j.status == "queued"]
+            if not (slot.ready and slot.proc.is_alive()):
+                # the worker died while we waited for work; its replacement reports idle again
+                for j in batch:
+                    self._enqueue(j)
+                continue
+            if not batch:
+                self.idle.put(slot.idx)
+                continue
+            slot.ready = False
+            slot.job_ids = [j.id for j in batch]
+            slot.tasks.put([Job(**asdict(j)) for j in batch])
 
-            np_frames = [np.array(fr.convert("RGB"), dtype=np.uint8) for fr in frames_out]
-            write_mp4(np_frames, Path(job.video_path), p["fps"])
+    def _collect(self):
+        while True:
+            try:
+                idx, job_id, fields = self._events.get(timeout=1.0)
+            except queue.Empty:
+                self._reap()
+                continue
 
-            job.current = steps_total
-            job.eta_seconds = 0.0
+            slot = self.slots[idx]
+            if job_id is None:
+                metrics.observe_stages(fields.get("stages", {}))
+                slot.model_loaded = fields.get("model_loaded", slot.model_loaded)
+                slot.model_memory = fields.get("model_memory", slot.model_memory)
+                if "mode_report" in fields:
+                    self.mode_report = fields["mode_report"]
+                if fields.get("idle") and not slot.ready:
+                    slot.job_ids = []
+                    slot.ready = True
+                    slot.preempting = False
+                    self.idle.put(idx)
+                continue
 
-        except Exception as e:
-            import traceback
-            tb = traceback.format_exc()
-            job.status = "failed"
-            job.error = f"{e.__class__.__name__}: {e}\n{tb}"
-            job.finished_ts = time.time()
-            _write_meta(job)
-            logger.exception("Pipeline failed: %s", e)
-            return
+            with self.lock:
+                job = self.jobs.get(job_id)
+            if not job:
+                continue
+            preview = fields.pop("preview", None)
+            step_s = fields.pop("step_s", None)
+            if step_s is not None:
+                metrics.STEP_SECONDS.observe(step_s, mode=fields.pop("step_mode", ""))
+            stages = fields.pop("stages", None)
+            if stages is not None:
+                metrics.observe_stages(stages)
+                continue
+            timing = fields.pop("timing", None)
+            if timing is not None:
+                self.cost.observe(timing)
+                continue
+            if fields.get("eta_seconds") is not None:
+                self._eta_marks[job.id] = (fields["eta_seconds"], time.time())
+            if job.status == "cancelling" and fields.get("status") == "running":
+                fields = {k: v for k, v in fields.items() if k != "status"}
+            elif job.status == "cancelling" and fields.get("status") == "queued":
+                # preempted after the cancel was sent: finish the cancel, don't re-queue
+                fields = {**fields, "status": "cancelled", "finished_ts": time.time()}
+            for k, v in fields.items():
+                setattr(job, k, v)
+            status = fields.get("status")
+            if status == "running":
+                self._start_ticker(job)
+            elif status in TERMINAL or status == "queued":
+                self._stop_ticker(job.id)
+            if status == "cancelled":
+                _remove_outputs(job)
+            self._persist(job, preview)
+            if status == "queued":
+                logger.info("Re-queued preempted job %s", job.id)
+                self._enqueue(job)
+
+    def _reap(self):
+        """Fail the job of any worker process that died and replace the process."""
+        for slot in self.slots:
+            if slot.proc is None or slot.proc.is_alive():
+                continue
+            logger.error("i2v worker %d exited (code=%s)", slot.idx, slot.proc.exitcode)
+            for job_id in slot.job_ids:
+                job = self.get(job_id)
+                if job and job.status not in TERMINAL:
+                    job.status = "failed"
+                    job.error = f"worker process exited (code={slot.proc.exitcode})"
+                    job.finished_ts = time.time()
+                    self._stop_ticker(job.id)
+                    self._persist(job)
+            self._spawn(slot)
+
+    def _start_ticker(self, job: Job):
+        """Count the ETA down between worker reports.
+
+        Until the first denoise step the estimate comes from the cost model;
+        after that it runs down from the ETA the worker last reported.
+        """
+        est_total = self.estimate_seconds(job)
+        stop_evt = threading.Event()
+        self._tickers[job.id] = stop_evt
+        self._eta_marks.pop(job.id, None)
+
+        def _tick():
+            while not stop_evt.is_set():
+                now = time.time()
+                mark = self._eta_marks.get(job.id)
+                if mark is not None:
+                    job.eta_seconds = max(0.0, mark[0] - (now - mark[1]))
+                else:
+                    job.eta_seconds = max(0.0, est_total - (now - (job.started_ts or now)))
+                stop_evt.wait(1.0)
+
+        threading.Thread(target=_tick, daemon=True).start()
+
+    def _stop_ticker(self, job_id: str):
+        evt = self._tickers.pop(job_id, None)
+        self._eta_marks.pop(job_id, None)
+        if evt is not None:
+            evt.set()
 
 JOBS = JobQueue()
 
@@ -287,19 +814,18 @@ def create_job(
     seed: Optional[int],
     prompt: Optional[str] = None,
     negative_prompt: Optional[str] = None,
+    mode: Optional[str] = None,
+    priority: int = 0,
+    encode_profile: Optional[str] = None,
+    loop: bool = False,
+    output_side: Optional[int] = None,
+    sky_crop: bool = False,
+    output_fps: Optional[int] = None,
+    profile: Optional[bool] = None,
 ) -> Job:
     if len(file_bytes) > 12 * 1024 * 1024:
         raise ValueError("image too large (max 12 MB)")
 
-    jid = str(uuid.uuid4())
-    job_dir   = os.path.join(DATA_DIR, jid)
-    os.makedirs(job_dir, exist_ok=True)
-    input_path = os.path.join(job_dir, "input.png")
-    video_path = os.path.join(job_dir, "out.mp4")
-
-    with open(input_path, "wb") as f:
-        f.write(file_bytes)
-
     params = {
         "frames": frames,
         "fps": fps,
@@ -310,31 +836,91 @@ def create_job(
         "seed": seed,
         "prompt": (prompt or "").strip() or PROMPT_DEFAULT,
         "negative_prompt": (negative_prompt or "").strip() or NEG_PROMPT_DEFAULT,
+        # resolved here so the cost model, cache and batch keys all see the mode that runs
+        "mode": resolve_mode(mode),
+        "encode_profile": resolve_profile(encode_profile),
+        "loop": bool(loop),
+        "output_side": output_side,
+        "sky_crop": bool(sky_crop),
+        "output_fps": output_fps,
+        "profile": I2V_PROFILE if profile is None else bool(profile),
     }
-
-    job = Job(
-        id=jid,
-        status="queued",
-        created_ts=time.time(),
-        current=0,
-        total=steps,
-        params=params,
-        job_dir=job_dir,
-        input_path=input_path,
-        video_path=video_path,
-    )
-
-    queued = sum(1 for j in JOBS.jobs.values() if j.status == "queued")
-    running = sum(1 for j in JOBS.jobs.values() if j.status == "running")
-    if queued >= MAX_QUEUE and running >= 1:
-        raise RuntimeError("Too many jobs queued. Please try again in a bit.")
-
-    JOBS.put(job)
-    _write_meta(job)
+    cache_key = _cache_key(file_bytes, params)
+    batch_key = _batch_key(file_bytes, params)
+
+    with JOBS.admit_lock:
+        if cache_key:
+            hit = JOBS.find_cached(cache_key)
+            if hit is not None:
+                logger.info("Request matches job %s (%s); reusing it", hit.id, hit.status)
+                return JOBS.attach(hit, priority)
+
+        if MAX_QUEUE and JOBS.count("queued") >= MAX_QUEUE and JOBS.count("running") >= JOBS.workers:
+            raise RuntimeError("Too many jobs queued. Please try again in a bit.")
+        backlog = JOBS.backlog_seconds()
+        if backlog > I2V_MAX_BACKLOG_S:
+            raise RuntimeError(
+                f"Queue is full (~{int(backlog)}s of work ahead). Please try again in a bit."
+            )
+
+        jid = str(uuid.uuid4())
+        job_dir   = os.path.join(DATA_DIR, jid)
+        os.makedirs(job_dir, exist_ok=True)
+        input_path = os.path.join(job_dir, "input.png")
+        video_path = os.path.join(job_dir, "out.mp4")
+
+        with open(input_path, "wb") as f:
+            f.write(file_bytes)
+
+        job = Job(
+            id=jid,
+            status="queued",
+            created_ts=time.time(),
+            current=0,
+            total=denoise_steps(params),
+            params=params,
+            job_dir=job_dir,
+            input_path=input_path,
+            video_path=video_path,
+            cache_key=cache_key,
+            batch_key=batch_key,
+            priority=priority,
+        )
+        JOBS.put(job)
+        _write_meta(job)
     return job
 
+def recover_jobs() -> None:
+    JOBS.recover()
+
+def warm_up() -> None:
+    """Startup hook: with ``I2V_PRELOAD`` (or ``I2V_WARMUP``) start the workers now so the
+    first job does not pay for process spawn, torch import and pipeline load."""
+    if I2V_PRELOAD:
+        JOBS._ensure_started()
+
+def cancel_job(job_id: str) -> Optional[Job]:
+    return JOBS.cancel(job_id)
+
 def get_job(job_id: str) -> Optional[Job]:
     return JOBS.get(job_id)
 
 def model_loaded() -> bool:
-    return ModelManager._loaded
+    return any(s.model_loaded for s in JOBS.slots)
+
+def worker_health() -> List[Dict]:
+    """Per-worker liveness, load state and memory, for /svd/health."""
+    out = []
+    for slot in JOBS.slots:
+        alive = slot.proc is not None and slot.proc.is_alive()
+        out.append({
+            "worker": slot.idx,
+            "pid": slot.proc.pid if slot.proc is not None else None,
+            "alive": alive,
+            "busy": bool(slot.job_ids),
+            "cores": len(slot.cores),
+            "model_loaded": slot.model_loaded,
+            "model_memory": slot.model_memory,
+            **(metrics.proc_stats(slot.proc.pid) if alive else {}),
+        })
+    return out
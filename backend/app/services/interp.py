@@ -0,0 +1,108 @@
+
+from __future__ import annotations
+from typing import Iterable, Iterator, Tuple
+import numpy as np
+
+_LUMA = np.array([0.299, 0.587, 0.114], dtype=np.float32)
+
+
+def estimate_shift(a: np.ndarray, b: np.ndarray, weight: np.ndarray,
+                   max_frac: float = 0.125) -> Tuple[float, float]:
+    """Global (dx, dy) with ``b ~= a`` moved by (dx, dy), by phase correlation over ``weight``.
+
+    Only the weighted (sky) region takes part. The peak is refined to
+    sub-pixel with a parabola per axis. Shifts beyond ``max_frac`` of the
+    frame are not trusted and come back as (0, 0), which turns interpolation
+    into a plain cross-fade.
+    """
+    ga = (a.astype(np.float32) @ _LUMA) * weight
+    gb = (b.astype(np.float32) @ _LUMA) * weight
+    ga -= ga.mean()
+    gb -= gb.mean()
+    cross = np.fft.rfft2(gb) * np.conj(np.fft.rfft2(ga))
+    cross /= np.abs(cross) + 1e-6
+    corr = np.fft.irfft2(cross, s=ga.shape)
+
+    h, w = corr.shape
+    py, px = np.unravel_index(int(np.argmax(corr)), corr.shape)
+
+    def _refine(c_m, c_0, c_p) -> float:
+        den = c_m - 2.0 * c_0 + c_p
+        return 0.0 if abs(den) < 1e-12 else 0.5 * (c_m - c_p) / den
+
+    dy = py + _refine(corr[py - 1, px], corr[py, px], corr[(py + 1) % h, px])
+    dx = px + _refine(corr[py, px - 1], corr[py, px], corr[py, (px + 1) % w])
+    dy = dy - h if dy > h / 2 else dy
+    dx = dx - w if dx > w / 2 else dx
+    if abs(dx) > w * max_frac or abs(dy) > h * max_frac:
+        return 0.0, 0.0
+    return float(dx), float(dy)
+
+
+def shift_image(img: np.ndarray, dx: float, dy: float) -> np.ndarray:
+    """``img`` moved by (dx, dy) with bilinear sampling and clamped edges; float32 out."""
+    h, w = img.shape[:2]
+    out = img.astype(np.float32)
+    if dx:
+        xs = np.clip(np.arange(w, dtype=np.float32) - dx, 0, w - 1)
+        x0 = xs.astype(np.int64)
+        x1 = np.minimum(x0 + 1, w - 1)
+        fx = (xs - x0)[None, :, None]
+        out = out[:, x0] * (1.0 - fx) + out[:, x1] * fx
+    if dy:
+        ys = np.clip(np.arange(h, dtype=np.float32) - dy, 0, h - 1)
+        y0 = ys.astype(np.int64)
+        y1 = np.minimum(y0 + 1, h - 1)
+        fy = (ys - y0)[:, None, None]
+        out = out[y0] * (1.0 - fy) + out[y1] * fy
+    return out
+
+
+def _between(a: np.ndarray, b: np.ndarray, d: Tuple[float, float], t: float,
+             alpha: np.ndarray) -> np.ndarray:
+    dx, dy = d
+    mix = shift_image(a, t * dx, t * dy) * (1.0 - t)
+    mix += shift_image(b, -(1.0 - t) * dx, -(1.0 - t) * dy) * t
+    near = (a if t < 0.5 else b).astype(np.float32)
+    mix -= near
+    mix *= alpha
+    mix += near
+    np.rint(mix, out=mix)
+    return np.clip(mix, 0, 255).astype(np.uint8)
+
+
+def interpolate_frames(keyframes: Iterable[np.ndarray], factor: int, mask: np.ndarray,
+                       loop: bool = False) -> Iterator[np.ndarray]:
+    """``factor - 1`` synthesized frames between consecutive keyframes, inside ``mask`` only.
+
+    Each pair's sky motion is modelled as one global translation
+    (``estimate_shift``); in-betweens blend both keyframes warped towards time
+    t. Outside the mask, in-betweens repeat the nearer keyframe, so static
+    pixels never ghost. K keyframes give ``(K - 1) * factor + 1`` frames, or
+    ``K * factor`` with ``loop`` (the last keyframe also blends into the first).
+    Keyframes are consumed lazily; only two are held at a time.
+    """
+    it = iter(keyframes)
+    first = prev = next(it, None)
+    if first is None:
+        return
+    if factor <= 1:
+        yield first
+        yield from it
+        return
+    alpha = np.asarray(mask, dtype=np.float32)[..., None]
+    weight = np.asarray(mask, dtype=np.float32)
+    steps = [k / factor for k in range(1, factor)]
+
+    def _pair(a, b):
+        d = estimate_shift(a, b, weight)
+        for t in steps:
+            yield _between(a, b, d, t, alpha)
+
+    yield prev
+    for cur in it:
+        yield from _pair(prev, cur)
+        yield cur
+        prev = cur
+    if loop and prev is not first:
+        yield from _pair(prev, first)
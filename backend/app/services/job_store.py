@@ -0,0 +1,97 @@
+
+from __future__ import annotations
+import json, sqlite3, threading
+from dataclasses import asdict, fields
+from pathlib import Path
+from typing import List, Optional, Sequence, Type, TypeVar
+
+T = TypeVar("T")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id          TEXT PRIMARY KEY,
+    status      TEXT NOT NULL,
+    created_ts  REAL NOT NULL,
+    started_ts  REAL,
+    finished_ts REAL,
+    cache_key   TEXT,
+    doc         TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_status_created ON jobs (status, created_ts);
+CREATE INDEX IF NOT EXISTS jobs_created ON jobs (created_ts);
+"""
+
+_INDEXES = """
+CREATE INDEX IF NOT EXISTS jobs_cache_key ON jobs (cache_key, status);
+"""
+
+class JobStore:
+    """SQLite (WAL) table of job records.
+
+    ``status`` and the timestamps are real columns so lookups by id, admission
+    counts by status and the restart scan are indexed; the full record is kept
+    as JSON in ``doc`` so new dataclass fields need no migration.
+    """
+
+    def __init__(self, path: Path, record_type: Type[T]):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._type = record_type
+        self._names = {f.name for f in fields(record_type)}
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        self._migrate()
+        self._conn.executescript(_INDEXES)
+
+    def _migrate(self) -> None:
+        cols = {row[1] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+        if "cache_key" not in cols:
+            self._conn.execute("ALTER TABLE jobs ADD COLUMN cache_key TEXT")
+
+    def _load(self, doc: str) -> T:
+        data = json.loads(doc)
+        return self._type(**{k: v for k, v in data.items() if k in self._names})
+
+    def upsert(self, job) -> None:
+        doc = json.dumps(asdict(job), ensure_ascii=False)
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO jobs (id, status, created_ts, started_ts, finished_ts, cache_key, doc) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(id) DO UPDATE SET status=excluded.status, started_ts=excluded.started_ts, "
+                "finished_ts=excluded.finished_ts, cache_key=excluded.cache_key, doc=excluded.doc",
+                (job.id, job.status, job.created_ts, job.started_ts, job.finished_ts,
+                 getattr(job, "cache_key", None), doc),
+            )
+
+    def get(self, job_id: str) -> Optional[T]:
+        with self._lock:
+            row = self._conn.execute("SELECT doc FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._load(row[0]) if row else None
+
+    def count(self, status: str) -> int:
+        with self._lock:
+            row = self._conn.execute("SELECT COUNT(*) FROM jobs WHERE status = ?", (status,)).fetchone()
+        return int(row[0])
+
+    def by_status(self, status: str) -> List[T]:
+        """Jobs in ``status``, oldest first."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT doc FROM jobs WHERE status = ? ORDER BY created_ts", (status,)
+            ).fetchall()
+        return [self._load(r[0]) for r in rows]
+
+    def by_cache_key(self, cache_key: str, statuses: Sequence[str]) -> List[T]:
+        """Jobs with ``cache_key`` in any of ``statuses``, newest first."""
+        marks = ", ".join("?" * len(statuses))
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT doc FROM jobs WHERE cache_key = ? AND status IN ({marks}) "
+                "ORDER BY created_ts DESC",
+                (cache_key, *statuses),
+            ).fetchall()
+        return [self._load(r[0]) for r in rows]
@@ -0,0 +1,134 @@
+
+from __future__ import annotations
+import math, threading
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+# Prometheus text exposition without the client library: a handful of
+# histograms fed by the API process, plus gauges computed at scrape time.
+
+_SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+
+def _fmt_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _num(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+class Histogram:
+    """Cumulative-bucket histogram keyed by a fixed tuple of label names."""
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = _SECONDS_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self._lock = threading.Lock()
+        # label values -> ([per-bucket counts], sum, count)
+        self._series: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = tuple(str(labels.get(n, "")) for n in self.labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = [(k, list(v[0]), v[1], v[2]) for k, v in self._series.items()]
+        for key, counts, total, n in sorted(items):
+            running = 0
+            for bound, c in zip(self.buckets, counts):
+                running += c
+                le = _fmt_labels(self.labels, key, f'le="{_num(bound)}"')
+                lines.append(f"{self.name}_bucket{le} {running}")
+            lbl = _fmt_labels(self.labels, key)
+            lines.append(f"{self.name}_sum{lbl} {_num(total)}")
+            lines.append(f"{self.name}_count{lbl} {n}")
+        return lines
+
+
+def gauge(name: str, help: str, samples: Iterable[Tuple[Dict[str, str], float]]) -> List[str]:
+    """Lines for a gauge whose ``(labels, value)`` samples were computed at scrape time."""
+    lines = [f"# HELP {name} {help}", f"# TYPE {name} gauge"]
+    for labels, value in samples:
+        lines.append(f"{name}{_fmt_labels(list(labels), list(labels.values()))} {_num(value)}")
+    return lines
+
+
+def proc_stats(pid: Optional[int] = None) -> Dict[str, float]:
+    """Resident memory (bytes) and thread count of ``pid`` (default: this process) from /proc.
+
+    ``rss_file_bytes`` is the file-backed part (e.g. memory-mapped weights),
+    which other processes mapping the same file share.
+    """
+    stats: Dict[str, float] = {}
+    rss_keys = {"VmRSS:": "rss_bytes", "RssAnon:": "rss_anon_bytes", "RssFile:": "rss_file_bytes"}
+    try:
+        with open(f"/proc/{pid or 'self'}/status", encoding="ascii") as f:
+            for line in f:
+                key = line.split(maxsplit=1)[0] if line.strip() else ""
+                if key in rss_keys:
+                    stats[rss_keys[key]] = float(line.split()[1]) * 1024.0
+                elif line.startswith("Threads:"):
+                    stats["threads"] = float(line.split()[1])
+    except OSError:
+        pass
+    if pid is None and "threads" not in stats:
+        stats["threads"] = float(threading.active_count())
+    return stats
+
+
+STAGE_SECONDS = Histogram(
+    "i2v_stage_seconds",
+    "Wall time of each i2v pipeline stage per worker call (batched jobs share one observation).",
+    ("stage",),
+)
+STEP_SECONDS = Histogram(
+    "i2v_denoise_step_seconds",
+    "Latency of one denoise step (whole batch) by inference mode.",
+    ("mode",),
+    buckets=(0.1, 0.25, 0.5, 1, 1.5, 2, 3, 4, 6, 8, 12, 16, 24, 32, 60),
+)
+REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds",
+    "HTTP request latency by route template.",
+    ("method", "route", "status"),
+)
+
+HISTOGRAMS = (STAGE_SECONDS, STEP_SECONDS, REQUEST_SECONDS)
+
+
+def observe_stages(stages: Dict[str, float]) -> None:
+    for stage, seconds in stages.items():
+        if seconds is not None:
+            STAGE_SECONDS.observe(seconds, stage=stage)
+
+
+def render(extra: Iterable[List[str]] = ()) -> str:
+    lines: List[str] = []
+    for block in extra:
+        lines.extend(block)
+    for hist in HISTOGRAMS:
+        lines.extend(hist.render())
+    return "\n".join(lines) + "\n"
@@ -1,14 +1,28 @@
+import itertools
 import math
-from typing import List
+import os
+from typing import Dict, Iterator
 import numpy as np
-from PIL import Image, ImageEnhance
+from PIL import Image
+
+# Bytes of rendered frames one light render may keep for replay; a 1920 px frame is ~6 MB,
+# so this holds a whole short period at preview sizes and a few levels at full resolution.
+LIGHT_FRAME_CACHE_MB = float(os.getenv("LIGHT_FRAME_CACHE_MB", "32"))
 
 
 def load_image_rgb(path: str) -> np.ndarray:
     return np.array(Image.open(path).convert("RGB"), dtype=np.uint8)
 
-def static_video_frames(img_rgb: np.ndarray, total_frames: int) -> List[np.ndarray]:
-    return [img_rgb.copy() for _ in range(total_frames)]
+def static_video_frames(img_rgb: np.ndarray, total_frames: int) -> Iterator[np.ndarray]:
+    """The same read-only frame ``total_frames`` times; nothing is copied."""
+    frame = img_rgb.view()
+    frame.flags.writeable = False
+    return itertools.repeat(frame, total_frames)
+
+def _brightness_lut(factor: float) -> np.ndarray:
+    # float32 multiply + truncation matches PIL's ImageEnhance.Brightness exactly
+    levels = np.arange(256, dtype=np.float32) * np.float32(factor)
+    return np.clip(levels, 0, 255).astype(np.uint8)
 
 def light_pulse_frames(
     img_rgb: np.ndarray,
@@ -16,15 +30,26 @@ def light_pulse_frames(
     fps: int,
     amplitude: float = 0.03,
     period_s: float = 6.0
-) -> List[np.ndarray]:
-    frames: List[np.ndarray] = []
-    base = Image.fromarray(img_rgb)
+) -> Iterator[np.ndarray]:
+    """Cosine brightness pulse, one uint8 LUT lookup per distinct frame.
+
+    Frames are keyed by their LUT, so a frame is rendered once per distinct
+    brightness level (at most one period, and the cosine's mirrored half
+    reuses it) and replayed as read-only arrays for the rest of the clip. Only
+    ``LIGHT_FRAME_CACHE_MB`` of frames are kept; levels past that are re-rendered.
+    """
     hz = 1.0 / period_s if period_s > 0 else 0.0
+    frames: Dict[bytes, np.ndarray] = {}
+    budget = int(LIGHT_FRAME_CACHE_MB * 1024 * 1024)
     for n in range(total_frames):
         t = n / fps
-        factor = 1.0 + amplitude * math.cos(2 * math.pi * hz * t)
-        enhancer = ImageEnhance.Brightness(base)
-        out = ImageEnhance.Brightness(base).enhance(factor)
-        frames.append(np.array(out, dtype=np.uint8))
-
-    return frames
\ No newline at end of file
+        lut = _brightness_lut(1.0 + amplitude * math.cos(2 * math.pi * hz * t))
+        key = lut.tobytes()
+        out = frames.get(key)
+        if out is None:
+            out = lut[img_rgb]
+            out.flags.writeable = False
+            if out.nbytes <= budget:
+                frames[key] = out
+                budget -= out.nbytes
+        yield out
@@ -0,0 +1,211 @@
+
+from __future__ import annotations
+import asyncio, hashlib, os, time, uuid, threading
+import multiprocessing as mp
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import logging
+
+logger = logging.getLogger("app.services.render_jobs")
+
+# Renders are CPU-bound numpy + libx264; each one also spawns a multi-threaded
+# ffmpeg, so by default leave half the cores for the encoders.
+RENDER_WORKERS = int(os.getenv("RENDER_WORKERS", str(max(1, (os.cpu_count() or 2) // 2))))
+RENDER_JOB_TTL_S = float(os.getenv("RENDER_JOB_TTL_S", "3600"))
+# x264 threads per render so concurrent encodes share the cores instead of oversubscribing
+ENCODE_THREADS = max(1, (os.cpu_count() or 1) // max(1, RENDER_WORKERS))
+
+
+def _render_static(path: str, out_path: str, params: Dict):
+    from app.services.encode import write_mp4
+    from app.services.presets import load_image_rgb, static_video_frames
+
+    image = load_image_rgb(path)
+    total_frames = max(1, int(params["duration_s"] * params["fps"]))
+    return write_mp4(static_video_frames(image, total_frames), Path(out_path), params["fps"],
+                     params.get("encode_profile"), ENCODE_THREADS)
+
+
+def _render_light(path: str, out_path: str, params: Dict):
+    from app.services.encode import write_mp4
+    from app.services.presets import load_image_rgb, light_pulse_frames
+
+    image = load_image_rgb(path)
+    fps = params["fps"]
+    total_frames = max(1, int(params["duration_s"] * fps))
+    frames = light_pulse_frames(image, total_frames, fps, params["amplitude"], params["period_s"])
+    return write_mp4(frames, Path(out_path), fps, params.get("encode_profile"), ENCODE_THREADS)
+
+
+def _render_sky(path: str, out_path: str, params: Dict):
+    from app.services.encode import write_mp4
+    from app.services.presets import load_image_rgb
+    from app.services.sky_anim import sky_frames
+    from app.utils.io import ensure_max_width
+
+    image = ensure_max_width(load_image_rgb(path), 1280)
+    frames = sky_frames(
+        rgb=image,
+        duration_s=params["duration_s"],
+        fps=params["fps"],
+        intensity=params["intensity"],
+        hue_bias=params["hue_bias"],
+        feather_px=params["feather_px"],
+        sky_speed_px_per_s=20.0,
+        mask_gamma=0.75,
+        mask_gain=2.0,
+        sky_contrast=1.6,
+        sky_mode="bands",
+        lighten_only=True,
+    )
+    return write_mp4(frames, Path(out_path), params["fps"], params.get("encode_profile"), ENCODE_THREADS)
+
+
+RENDERERS = {
+    "static": _render_static,
+    "light": _render_light,
+    "sky": _render_sky,
+}
+
+
+def _run(kind: str, path: str, out_path: str, params: Dict) -> Dict:
+    """Pool entry point; returns the worker-side start/finish times and encode stats."""
+    started = time.time()
+    stats = RENDERERS[kind](path, out_path, params)
+    return {"started_ts": started, "finished_ts": time.time(), "encode": stats.as_meta()}
+
+
+@dataclass
+class RenderJob:
+    id: str
+    kind: str
+    status: str  # queued|running|done|failed
+    created_ts: float
+    params: Dict
+    input_path: str
+    video_path: str
+    started_ts: Optional[float] = None
+    finished_ts: Optional[float] = None
+    error: Optional[str] = None
+    encode: Optional[Dict] = None
+    future: Optional[Future] = field(default=None, repr=False, compare=False)
+
+
+def render_event(job: RenderJob) -> Dict:
+    return {
+        "job_id": job.id,
+        "kind": job.kind,
+        "status": job.status,
+        "created_ts": job.created_ts,
+        "started_ts": job.started_ts,
+        "finished_ts": job.finished_ts,
+        "error": job.error,
+        "encode": job.encode,
+    }
+
+
+class RenderEngine:
+    """Process pool for the fast /video presets.
+
+    Frame generation and libx264 run in ``RENDER_WORKERS`` spawned processes, so
+    the event loop only ever awaits a future. The synchronous endpoints await
+    ``run``; the job endpoints ``submit`` and return at once. Job records are
+    in memory and dropped ``RENDER_JOB_TTL_S`` after they finish.
+
+    Each process is its own single-worker lane, and a render goes to the lane
+    picked by its input's content hash. Re-renders of one still therefore hit the
+    per-process ``sky_mask`` and light-frame caches instead of recomputing them in
+    whichever process is free; different stills can share a lane and then queue.
+    """
+
+    def __init__(self, workers: int = RENDER_WORKERS):
+        self.workers = max(1, workers)
+        self.jobs: Dict[str, RenderJob] = {}
+        self.lock = threading.Lock()
+        self._pools: List[Optional[ProcessPoolExecutor]] = [None] * self.workers
+
+    def _pool(self, lane: int) -> ProcessPoolExecutor:
+        with self.lock:
+            if self._pools[lane] is None:
+                self._pools[lane] = ProcessPoolExecutor(1, mp_context=mp.get_context("spawn"))
+            return self._pools[lane]
+
+    def _lane(self, input_path: str) -> int:
+        h = hashlib.sha256()
+        with open(input_path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+        return int.from_bytes(h.digest()[:8], "big") % self.workers
+
+    def submit(self, kind: str, input_path: Path, out_path: Path, params: Dict) -> RenderJob:
+        if kind not in RENDERERS:
+            raise ValueError(f"unknown render kind {kind!r}")
+        self._prune()
+        job = RenderJob(
+            id=uuid.uuid4().hex,
+            kind=kind,
+            status="queued",
+            created_ts=time.time(),
+            params=params,
+            input_path=str(input_path),
+            video_path=str(out_path),
+        )
+        with self.lock:
+            self.jobs[job.id] = job
+        lane = self._lane(job.input_path)
+        pool = self._pool(lane)
+        job.future = pool.submit(_run, kind, job.input_path, job.video_path, params)
+        job.future.add_done_callback(lambda fut, job=job: self._finish(job, fut, lane, pool))
+        return job
+
+    async def run(self, kind: str, input_path: Path, out_path: Path, params: Dict) -> RenderJob:
+        """Submit and wait without blocking the event loop; re-raises render errors."""
+        job = self.submit(kind, input_path, out_path, params)
+        await asyncio.wrap_future(job.future)
+        return job
+
+    def get(self, job_id: str) -> Optional[RenderJob]:
+        with self.lock:
+            job = self.jobs.get(job_id)
+        if job is not None and job.status == "queued" and job.future.running():
+            job.status = "running"
+        return job
+
+    def _finish(self, job: RenderJob, fut: Future, lane: int, pool: ProcessPoolExecutor) -> None:
+        exc = fut.exception()
+        if exc is not None:
+            logger.error("Render job %s (%s) failed: %s", job.id, job.kind, exc)
+            job.status = "failed"
+            job.error = str(exc)
+            job.finished_ts = time.time()
+            if isinstance(exc, BrokenProcessPool):
+                # a render process died (e.g. OOM); start a fresh one for later jobs
+                with self.lock:
+                    if self._pools[lane] is pool:
+                        self._pools[lane] = None
+            return
+        times = fut.result()
+        job.started_ts = times["started_ts"]
+        job.finished_ts = times["finished_ts"]
+        job.encode = times["encode"]
+        job.status = "done"
+
+    def _prune(self) -> None:
+        cutoff = time.time() - RENDER_JOB_TTL_S
+        with self.lock:
+            for job_id in [j.id for j in self.jobs.values() if j.finished_ts and j.finished_ts < cutoff]:
+                del self.jobs[job_id]
+
+    def shutdown(self) -> None:
+        with self.lock:
+            pools, self._pools = self._pools, [None] * self.workers
+        for pool in pools:
+            if pool is not None:
+                pool.shutdown(wait=False, cancel_futures=True)
+
+
+RENDERS = RenderEngine()
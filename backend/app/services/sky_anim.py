@@ -1,7 +1,12 @@
 from __future__ import annotations
+import hashlib
 import io
 import math
-from typing import Tuple
+import os
+import threading
+from collections import OrderedDict
+from fractions import Fraction
+from typing import Optional, Tuple
 import numpy as np
 from PIL import Image, ImageOps
 import imageio.v3 as iio
@@ -16,51 +21,174 @@ logger = logging.getLogger("sky_anim")
 
 
 
+SKY_MASK_CACHE = int(os.getenv("SKY_MASK_CACHE", "16"))
+_mask_cache: "OrderedDict[tuple, np.ndarray]" = OrderedDict()
+_mask_cache_lock = threading.Lock()
+
+
+def _box_blur_axis(a: np.ndarray, radius: int, axis: int) -> np.ndarray:
+    """Edge-clamped running mean along ``axis``; cost does not depend on ``radius``."""
+    pad = [(0, 0)] * a.ndim
+    pad[axis] = (radius + 1, radius)
+    c = np.cumsum(np.pad(a, pad, mode="edge"), axis=axis, dtype=np.float64)
+    k = 2 * radius + 1
+    hi = [slice(None)] * a.ndim
+    lo = [slice(None)] * a.ndim
+    hi[axis] = slice(k, None)
+    lo[axis] = slice(None, -k)
+    out = c[tuple(hi)] - c[tuple(lo)]
+    out *= 1.0 / k
+    return out.astype(np.float32)
+
+
+def _feather(mask: np.ndarray, feather_px: int, passes: int = 2) -> np.ndarray:
+    # stacked box passes per axis approximate a Gaussian reaching ~feather_px
+    radius = max(1, feather_px // passes)
+    for axis in (0, 1):
+        for _ in range(passes):
+            mask = _box_blur_axis(mask, radius, axis)
+    return mask
+
+
 def _soft_sky_mask(rgb: np.ndarray, feather_px: int = 8, hue_bias: float = 0.0) -> np.ndarray:
-    rgb_f = rgb.astype(np.float32) / 255.0
+    rgb_f = rgb.astype(np.float32)
+    rgb_f *= 1.0 / 255.0
     r, g, b = rgb_f[..., 0], rgb_f[..., 1], rgb_f[..., 2]
     maxc = np.max(rgb_f, axis=-1)
-    minc = np.min(rgb_f, axis=-1)
-    v= maxc
-    saturation = np.where(maxc == 0, 0.0, (maxc - minc) / (maxc + 1e-6))
-    hue = np.zeros_like(maxc)
-    mask = (maxc != minc)
-
-    rc = (maxc - r) / (maxc - minc + 1e-6)
-    gc = (maxc - g) / (maxc - minc + 1e-6)
-    bc = (maxc - b) / (maxc - minc + 1e-6)  
-
-    hue = np.where((maxc == r) & mask, (bc - gc), hue)
-    hue = np.where((maxc == g) & mask, 2.0 + (rc - bc), hue)
-    hue = np.where((maxc == b) & mask, 4.0 + (gc - rc), hue)
-    hue = (hue / 6.0) % 1.0
+    delta = np.min(rgb_f, axis=-1)
+    np.subtract(maxc, delta, out=delta)
+    is_g = maxc == g
+    is_b = maxc == b
+
+    # hue sector numerator, later sectors win ties (r -> g -> b)
+    hue = np.subtract(g, b)
+    tmp = np.subtract(b, r)
+    np.copyto(hue, tmp, where=is_g)
+    np.subtract(r, g, out=tmp)
+    np.copyto(hue, tmp, where=is_b)
+    np.add(delta, 1e-6, out=tmp)
+    hue /= tmp
+    np.add(hue, 2.0, out=hue, where=is_g & ~is_b)
+    np.add(hue, 4.0, out=hue, where=is_b)
+    hue[delta == 0] = 0.0
+    hue /= 6.0
+    np.mod(hue, 1.0, out=hue)
+
+    # saturation
+    np.add(maxc, 1e-6, out=tmp)
+    delta /= tmp
 
     center = 0.61 + 0.06 * hue_bias
     width = 0.20
 
-    dist = np.minimum(np.abs(hue - center), 1.0 - np.abs(hue - center))
-    hue_score = np.clip(1.0 - dist / width, 0.0, 1.0)
-
-    brightness_score = np.clip((v - 0.5) / 0.5, 0.0, 1.0)
-    desaturation_score = 1.0 - np.clip((saturation - 0.2)/ 0.6, 0.0, 1.0)
-
-    base = hue_score * 0.6 +  brightness_score * 0.3 + desaturation_score * 0.1
-    base = np.clip(base, 0.0, 1.0)
+    # hue score: circular distance to center
+    hue -= center
+    np.abs(hue, out=hue)
+    np.subtract(1.0, hue, out=tmp)
+    np.minimum(hue, tmp, out=hue)
+    hue *= -1.0 / width
+    hue += 1.0
+    np.clip(hue, 0.0, 1.0, out=hue)
+    base = hue
+    base *= 0.6
+
+    # brightness score
+    maxc -= 0.5
+    maxc /= 0.5
+    np.clip(maxc, 0.0, 1.0, out=maxc)
+    maxc *= 0.3
+    base += maxc
+
+    # desaturation score
+    delta -= 0.2
+    delta /= 0.6
+    np.clip(delta, 0.0, 1.0, out=delta)
+    delta *= -0.1
+    delta += 0.1
+    base += delta
+    np.clip(base, 0.0, 1.0, out=base)
 
     if feather_px > 0:
-        for axis in (0, 1):
-            for _ in range(2):
-                base = (np.roll(base, 1, axis = axis) + base + np.roll(base, -1, axis = axis)) / 3.0
-        base = np.clip(base, 0.0, 1.0)
-    
+        base = _feather(base, feather_px)
+        np.clip(base, 0.0, 1.0, out=base)
+
     return base
 
 def _boost_mask(mask : np.ndarray, mask_gamma: float = 0.75, mask_gain: float = 2.0) -> np.ndarray:
     m = np.clip(mask.astype(np.float32), 0.0, 1.0)
-    m = np.power(m, mask_gamma)
+    np.power(m, mask_gamma, out=m)
     m *= mask_gain
+    return np.clip(m, 0.0, 1.0, out=m)
+
 
-    return np.clip(m, 0.0, 1.0)
+def sky_mask(
+    rgb: np.ndarray,
+    feather_px: int = 8,
+    hue_bias: float = 0.0,
+    mask_gamma: float = 0.75,
+    mask_gain: float = 2.0,
+) -> np.ndarray:
+    """Boosted soft sky mask (H, W) float32, memoised by image content.
+
+    Keyed by a hash of the pixels plus every mask parameter, so re-rendering
+    the same still with another intensity, duration or speed skips the HSV
+    scoring and feathering. The returned array is shared and read-only.
+    """
+    digest = hashlib.blake2b(np.ascontiguousarray(rgb).data, digest_size=16).hexdigest()
+    key = (digest, rgb.shape, float(hue_bias), int(feather_px), float(mask_gamma), float(mask_gain))
+    with _mask_cache_lock:
+        hit = _mask_cache.get(key)
+        if hit is not None:
+            _mask_cache.move_to_end(key)
+            return hit
+
+    raw = _soft_sky_mask(rgb, feather_px=feather_px, hue_bias=hue_bias)
+    mask = _boost_mask(raw, mask_gamma=mask_gamma, mask_gain=mask_gain)
+    mask.flags.writeable = False
+
+    with _mask_cache_lock:
+        _mask_cache[key] = mask
+        while len(_mask_cache) > max(0, SKY_MASK_CACHE):
+            _mask_cache.popitem(last=False)
+    return mask
+
+
+def sky_crop_box(
+    rgb: np.ndarray,
+    multiple: int = 8,
+    pad_px: int = 16,
+    threshold: float = 0.6,
+    coverage: float = 0.05,
+    min_side: int = 64,
+) -> Optional[Tuple[int, int, int, int]]:
+    """Padded ``(left, top, right, bottom)`` box around the sky, snapped outwards to ``multiple``.
+
+    Rows and columns count as sky when at least ``coverage`` of their pixels
+    score above ``threshold`` in the unboosted mask, so stray bright pixels on
+    the facade do not stretch the box. ``rgb`` must already have sides
+    divisible by ``multiple``. Returns None when there is no sky or the box
+    would be the whole frame.
+    """
+    h, w = rgb.shape[:2]
+    sky = _soft_sky_mask(rgb) > threshold
+    rows = np.flatnonzero(sky.mean(axis=1) >= coverage)
+    cols = np.flatnonzero(sky.mean(axis=0) >= coverage)
+    if rows.size == 0 or cols.size == 0:
+        return None
+    top = max(0, rows[0] - pad_px) // multiple * multiple
+    left = max(0, cols[0] - pad_px) // multiple * multiple
+    bottom = min(h, -(-(rows[-1] + 1 + pad_px) // multiple) * multiple)
+    right = min(w, -(-(cols[-1] + 1 + pad_px) // multiple) * multiple)
+    # grow towards the far edge until the crop is big enough for the UNet
+    min_h, min_w = min(h, min_side), min(w, min_side)
+    if bottom - top < min_h:
+        bottom = min(h, top + min_h)
+        top = bottom - min_h
+    if right - left < min_w:
+        right = min(w, left + min_w)
+        left = right - min_w
+    box = (int(left), int(top), int(right), int(bottom))
+    return None if box == (0, 0, w, h) else box
 
 
 
@@ -105,22 +233,92 @@ def _generate_sky_texture(
     return (sky * 255.0 + 0.5).astype(np.uint8)
 
 
+_BANDS_FREQ = 0.08
+SKY_FRAME_CACHE = int(os.getenv("SKY_FRAME_CACHE", "64"))
+
+
 def _sky_texture(shape, mode="bands", sky_contrast: float = 1.6):
     H, W = shape[:2]
     yy, xx = np.mgrid[0:H, 0:W]
     if mode == "bands":
-        freq = 0.08
+        freq = _BANDS_FREQ
         base= 0.5 + 0.5 * np.sin(2.0 * np.pi * freq * xx)
         grad = 0.85 + 0.15 * (1.0 - (yy.astype(np.float32) / max(1, H -1)))
         tex = base * grad
     else:
         y = np.linspace(0.0, 1.0, H, dtype=np.float32)[:, None]
-        tex = (0.6 + 0.4 * y)
+        tex = np.broadcast_to(0.6 + 0.4 * y, (H, W))
 
     tex = np.clip((tex - 0.5) * sky_contrast + 0.5, 0.0, 1.0)
     tex = (255 * np.dstack([tex, tex, tex])).astype(np.uint8)
     return tex
 
+
+def _texture_period(mode: str) -> int:
+    """Smallest integer horizontal shift that maps the texture onto itself."""
+    if mode != "bands":
+        return 1
+    return Fraction(_BANDS_FREQ).limit_denominator(1000).denominator
+
+
+class _SkyRenderer:
+    """Fixed-point blender for one still; the only per-frame input is the shift.
+
+    Everything that does not move is prepared once: the 8.8 fixed-point alpha,
+    the static ``base * (1 - alpha)`` term and a texture strip one period wider
+    than the frame, so a shifted texture is a slice instead of an ``np.roll``.
+    Because the texture repeats every ``period`` pixels, frames are keyed by
+    ``shift % period`` and rendered at most once.
+    """
+
+    def __init__(self, base_rgb: np.ndarray, mask: np.ndarray, intensity: float,
+                 sky_mode: str, sky_contrast: float, lighten_only: bool):
+        H, W = base_rgb.shape[:2]
+        self.W = W
+        self.lighten_only = lighten_only
+        self.period = _texture_period(sky_mode)
+        self.base = np.ascontiguousarray(base_rgb)
+        self.tex = _sky_texture((H, W + self.period), mode=sky_mode, sky_contrast=sky_contrast)
+        self.alpha = np.rint(np.clip(intensity * mask, 0.0, 1.0) * 256.0).astype(np.uint16)
+
+        if lighten_only:
+            # out = base + alpha * max(tex - base, 0); fits in uint16.
+            self._diff = np.empty_like(self.base)
+            self._acc = np.empty(self.base.shape, dtype=np.uint16)
+        else:
+            # out = base * (256 - alpha) + tex * alpha, +128 for rounding.
+            self.static = self.base.astype(np.uint32) * (256 - self.alpha) + 128
+            self._acc = np.empty(self.base.shape, dtype=np.uint32)
+        self._frames: dict[int, np.ndarray] = {}
+
+    def frame(self, shift: int) -> np.ndarray:
+        key = shift % self.period
+        cached = self._frames.get(key)
+        if cached is not None:
+            return cached
+
+        start = self.period - key
+        tex = self.tex[:, start:start + self.W]
+        out = np.empty_like(self.base)
+        acc = self._acc
+        if self.lighten_only:
+            np.maximum(tex, self.base, out=self._diff)
+            np.subtract(self._diff, self.base, out=self._diff)
+            np.multiply(self._diff, self.alpha, out=acc)
+            acc += 128
+            acc >>= 8
+            np.add(acc, self.base, out=acc)
+        else:
+            np.multiply(tex, self.alpha, out=acc)
+            acc += self.static
+            acc >>= 8
+        np.copyto(out, acc, casting="unsafe")
+        out.flags.writeable = False
+
+        if len(self._frames) < SKY_FRAME_CACHE:
+            self._frames[key] = out
+        return out
+
 def sky_frames(
     rgb: np.ndarray,
     duration_s: float = 4.0,
@@ -150,28 +348,23 @@ def sky_frames(
     
 
     base_rgb = rgb.astype(np.uint8)
-    raw_mask = _soft_sky_mask(base_rgb, feather_px=feather_px, hue_bias=hue_bias)
-    mask = _boost_mask(raw_mask, mask_gamma=mask_gamma, mask_gain=mask_gain)[..., None]
+    mask = sky_mask(
+        base_rgb, feather_px=feather_px, hue_bias=hue_bias,
+        mask_gamma=mask_gamma, mask_gain=mask_gain,
+    )[..., None]
     
     if debug_dump_mask_path:
         import imageio.v3 as iio
         iio.imwrite(debug_dump_mask_path, (mask[..., 0] * 255).astype(np.uint8))
     
-    sky_tex0 = _sky_texture(base_rgb.shape, mode=sky_mode, sky_contrast=sky_contrast)
+    renderer = _SkyRenderer(
+        base_rgb, mask, intensity,
+        sky_mode=sky_mode, sky_contrast=sky_contrast, lighten_only=lighten_only,
+    )
 
     total = max(1, int(round(duration_s * fps)))
-    logger.info("Total frames=%d fps=%d", total, fps)
+    logger.info("Total frames=%d fps=%d period=%dpx", total, fps, renderer.period)
 
-    
     for t in range(total):
-        shift = int(round((sky_speed_px_per_s * t) / fps))
-        sky_tex = np.roll(sky_tex0, shift, axis=1)  # move left→right
-
-        if lighten_only:
-            blend_base = np.maximum(base_rgb, sky_tex).astype(np.float32)
-        else:
-            blend_base = sky_tex.astype(np.float32)
-
-        alpha = float(intensity) * mask  
-        out = base_rgb.astype(np.float32) * (1.0 - alpha) + blend_base * alpha
-        yield np.clip(out, 0, 255).astype(np.uint8)
\ No newline at end of file
+        shift = int(round((sky_speed_px_per_s * t) / fps))  # move left→right
+        yield renderer.frame(shift)
@@ -2,6 +2,7 @@ import os
 import uuid
 from pathlib import Path
 from fastapi import UploadFile
+from fastapi.concurrency import run_in_threadpool
 from PIL import Image
 import numpy as np
 
@@ -21,6 +22,21 @@ def save_upload(file: UploadFile) -> Path:
         f.write(file.file.read())
     return Path
 
+async def save_upload_async(file: UploadFile, chunk_size: int = 1 << 20) -> Path:
+    """Stream an upload to disk in chunks without blocking the event loop."""
+    ext = os.path.splitext(file.filename or "")[1].lower()
+    if ext not in {".jpg", ".jpeg", ".png", ".bmp"}:
+        ext = ".png"
+    path = UPLOAD_DIR / f"{uuid.uuid4().hex}{ext}"
+
+    f = await run_in_threadpool(path.open, "wb")
+    try:
+        while chunk := await file.read(chunk_size):
+            await run_in_threadpool(f.write, chunk)
+    finally:
+        await run_in_threadpool(f.close)
+    return path
+
 def make_output_path(suffix: str = "mp4") -> Path:
     return OUTPUT_DIR / f"{uuid.uuid4().hex}.{suffix}"
 
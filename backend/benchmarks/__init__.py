@@ -0,0 +1,11 @@
+"""Offline benchmarks for the render and inference hot paths.
+
+Run from ``backend/``::
+
+    python -m benchmarks                      # all cases, compared with baseline.json if present
+    python -m benchmarks --only sky,mask      # a subset
+    python -m benchmarks --save-baseline      # record the current numbers
+
+Nothing is downloaded: renders are synthetic and the i2v case uses a tiny,
+randomly initialised AnimateDiff pipeline.
+"""
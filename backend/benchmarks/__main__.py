@@ -0,0 +1,118 @@
+
+from __future__ import annotations
+import argparse, json, math, multiprocessing as mp, platform, os, sys
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List
+
+from benchmarks.cases import CASES, SIZES, run_case
+
+BASELINE = Path(__file__).resolve().parent / "baseline.json"
+
+
+def _gated(metric: str) -> bool:
+    # times and memory; bitrate is informational
+    return metric.endswith("ms") or metric == "peak_rss_mb"
+
+
+def run(names: List[str], sizes: List[int]) -> Dict[str, Dict]:
+    results: Dict[str, Dict] = {}
+    ctx = mp.get_context("spawn")
+    for name in names:
+        for size in sizes:
+            # i2v runs at a fixed tiny latent size; one row is enough
+            if name == "i2v" and size != sizes[0]:
+                continue
+            with ProcessPoolExecutor(1, mp_context=ctx) as pool:
+                metrics = pool.submit(run_case, name, size).result()
+            key = f"{name}@{size}"
+            results[key] = metrics
+            shown = "  ".join(f"{k}={v:.2f}" for k, v in metrics.items() if isinstance(v, float))
+            print(f"{key:<14} {metrics.get('error') or shown}", flush=True)
+    return results
+
+
+def _broken(metrics: Dict) -> bool:
+    return "error" in metrics or any(isinstance(v, float) and math.isnan(v) for v in metrics.values())
+
+
+def failures(results: Dict[str, Dict]) -> List[str]:
+    """Lines for every case that errored or produced a NaN metric."""
+    lines = []
+    for key, metrics in results.items():
+        if "error" in metrics:
+            lines.append(f"{key}: {metrics['error']}")
+        lines += [f"{key} {metric}: NaN" for metric, value in metrics.items()
+                  if isinstance(value, float) and math.isnan(value)]
+    return lines
+
+
+def compare(results: Dict[str, Dict], baseline: Dict[str, Dict], tolerance: float) -> List[str]:
+    """Lines for every metric more than ``tolerance`` worse than the baseline, or missing from it."""
+    regressions = []
+    for key, metrics in results.items():
+        if _broken(metrics):
+            continue  # reported by ``failures``
+        if key not in baseline:
+            regressions.append(f"{key}: no baseline row (record one with --save-baseline)")
+            continue
+        for metric, value in metrics.items():
+            if not _gated(metric) or not isinstance(value, float):
+                continue
+            old = baseline[key].get(metric)
+            if not isinstance(old, (int, float)):
+                regressions.append(f"{key} {metric}: not in baseline")
+                continue
+            if old <= 0:
+                continue
+            change = value / old - 1.0
+            if change > tolerance:
+                regressions.append(f"{key} {metric}: {old:.2f} -> {value:.2f} ({change:+.0%})")
+    return regressions
+
+
+def main(argv: List[str] | None = None) -> int:
+    ap = argparse.ArgumentParser(prog="python -m benchmarks", description="Offline render and inference benchmarks.")
+    ap.add_argument("--only", help=f"comma-separated cases ({', '.join(CASES)})")
+    ap.add_argument("--sizes", default=",".join(map(str, SIZES)), help="render widths, comma-separated")
+    ap.add_argument("--baseline", type=Path, default=BASELINE)
+    ap.add_argument("--save-baseline", action="store_true", help="write these results as the baseline")
+    ap.add_argument("--tolerance", type=float, default=0.15, help="allowed slowdown before failing (0.15 = 15%%)")
+    ap.add_argument("--json", type=Path, help="also write the results here")
+    args = ap.parse_args(argv)
+
+    names = args.only.split(",") if args.only else list(CASES)
+    unknown = [n for n in names if n not in CASES]
+    if unknown:
+        ap.error(f"unknown case(s): {', '.join(unknown)}")
+    sizes = [int(s) for s in args.sizes.split(",")]
+
+    print(f"# {platform.processor() or platform.machine()}, {os.cpu_count()} cpus, python {platform.python_version()}")
+    results = run(names, sizes)
+    if args.json:
+        args.json.write_text(json.dumps(results, indent=2), encoding="utf-8")
+
+    failed = failures(results)
+    for line in failed:
+        print(f"FAILED {line}")
+
+    if args.save_baseline:
+        baseline = json.loads(args.baseline.read_text(encoding="utf-8")) if args.baseline.exists() else {}
+        baseline.update({k: v for k, v in results.items() if not _broken(v)})
+        args.baseline.write_text(json.dumps(baseline, indent=2, sort_keys=True), encoding="utf-8")
+        print(f"baseline written to {args.baseline}")
+        return 1 if failed else 0
+    if not args.baseline.exists():
+        print("no baseline yet; run with --save-baseline to record one")
+        return 1 if failed else 0
+
+    regressions = compare(results, json.loads(args.baseline.read_text(encoding="utf-8")), args.tolerance)
+    for line in regressions:
+        print(f"REGRESSION {line}")
+    if not regressions and not failed:
+        print(f"no regressions beyond {args.tolerance:.0%} of {args.baseline.name}")
+    return 1 if regressions or failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,188 @@
+
+from __future__ import annotations
+import resource, statistics, sys, tempfile, time
+from pathlib import Path
+from typing import Callable, Dict, List
+
+import numpy as np
+
+SIZES = (512, 1280, 1920)
+FRAMES = 48
+FPS = 24
+
+
+def synthetic_render(width: int, seed: int = 0) -> np.ndarray:
+    """Architectural-looking still: gradient sky with soft clouds, a gridded facade, ground."""
+    height = width * 9 // 16
+    rng = np.random.default_rng(seed)
+    y = np.linspace(0.0, 1.0, height, dtype=np.float32)[:, None, None]
+    img = (1.0 - y) * np.array([150, 190, 245], np.float32) + y * np.array([200, 220, 245], np.float32)
+    img = np.broadcast_to(img, (height, width, 3)).copy()
+    clouds = rng.random((height // 32 + 2, width // 32 + 2)).astype(np.float32)
+    clouds = np.kron(clouds, np.ones((32, 32), np.float32))[:height, :width, None]
+    img += 30.0 * clouds
+
+    top, left, right = int(height * 0.35), width // 6, width * 5 // 6
+    img[top:, left:right] = (150, 140, 128)
+    img[top::24, left:right] = (90, 90, 95)
+    img[top:, left:right:32] = (90, 90, 95)
+    img[int(height * 0.85):] = (110, 105, 95)
+    return np.clip(img, 0, 255).astype(np.uint8)
+
+
+def _peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024.0 * 1024.0) if sys.platform == "darwin" else peak / 1024.0
+
+
+def _per_frame_ms(make_frames: Callable[[], object], frames: int, reps: int = 3) -> float:
+    times = []
+    for _ in range(reps):
+        t0 = time.perf_counter()
+        for _ in make_frames():
+            pass
+        times.append((time.perf_counter() - t0) * 1000.0 / frames)
+    return statistics.median(times)
+
+
+def bench_mask(size: int) -> Dict:
+    from app.services.sky_anim import _boost_mask, _soft_sky_mask
+
+    rgb = synthetic_render(size)
+    ms = _per_frame_ms(lambda: [_boost_mask(_soft_sky_mask(rgb))], 1)
+    return {"ms": ms}
+
+
+def bench_sky(size: int) -> Dict:
+    from app.services import sky_anim
+
+    rgb = synthetic_render(size)
+    sky_anim.sky_mask(rgb)  # mask cost is its own case
+    ms = _per_frame_ms(lambda: sky_anim.sky_frames(rgb, duration_s=FRAMES / FPS, fps=FPS, sky_speed_px_per_s=20.0),
+                       FRAMES)
+    return {"ms": ms}
+
+
+def bench_light(size: int) -> Dict:
+    from app.services.presets import light_pulse_frames
+
+    rgb = synthetic_render(size)
+    return {"ms": _per_frame_ms(lambda: light_pulse_frames(rgb, FRAMES, FPS), FRAMES)}
+
+
+def bench_resize(size: int) -> Dict:
+    from app.utils.io import ensure_max_width
+
+    rgb = synthetic_render(size)
+    return {"ms": _per_frame_ms(lambda: [ensure_max_width(rgb, 1280)], 1)}
+
+
+def bench_encode(size: int) -> Dict:
+    from app.services.encode import write_mp4
+    from app.services.presets import light_pulse_frames
+
+    rgb = synthetic_render(size)
+    frames = list(light_pulse_frames(rgb, FRAMES, FPS))
+    out: Dict = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for profile in ("fast-preview", "web"):
+            t0 = time.perf_counter()
+            stats = write_mp4(iter(frames), Path(tmp) / f"{profile}.mp4", FPS, profile)
+            out[f"{profile}.ms"] = (time.perf_counter() - t0) * 1000.0 / FRAMES
+            out[f"{profile}.kbps"] = stats.bitrate_kbps
+    return out
+
+
+def _tiny_pipeline():
+    """AnimateDiff vid2vid with a few-channel UNet, motion adapter, VAE and CLIP; random weights."""
+    import torch
+    from diffusers import (
+        AnimateDiffVideoToVideoPipeline, AutoencoderKL, LCMScheduler, MotionAdapter, UNet2DConditionModel,
+    )
+    from transformers import CLIPTextConfig, CLIPTextModel
+
+    torch.manual_seed(0)
+    unet = UNet2DConditionModel(
+        block_out_channels=(32, 64), layers_per_block=2, sample_size=32, in_channels=4, out_channels=4,
+        down_block_types=("CrossAttnDownBlock2D", "DownBlock2D"),
+        up_block_types=("UpBlock2D", "CrossAttnUpBlock2D"),
+        cross_attention_dim=32, norm_num_groups=2,
+    )
+    vae = AutoencoderKL(
+        block_out_channels=[32, 64], in_channels=3, out_channels=3,
+        down_block_types=["DownEncoderBlock2D", "DownEncoderBlock2D"],
+        up_block_types=["UpDecoderBlock2D", "UpDecoderBlock2D"],
+        latent_channels=4, norm_num_groups=2,
+    )
+    text_encoder = CLIPTextModel(CLIPTextConfig(
+        bos_token_id=0, eos_token_id=2, hidden_size=32, intermediate_size=37, layer_norm_eps=1e-05,
+        num_attention_heads=4, num_hidden_layers=2, pad_token_id=1, vocab_size=1000,
+    ))
+    adapter = MotionAdapter(
+        block_out_channels=(32, 64), motion_layers_per_block=2,
+        motion_norm_num_groups=2, motion_num_attention_heads=4,
+    )
+    return AnimateDiffVideoToVideoPipeline(
+        vae=vae, text_encoder=text_encoder, tokenizer=None, unet=unet, motion_adapter=adapter,
+        scheduler=LCMScheduler(beta_schedule="linear"), feature_extractor=None, image_encoder=None,
+    )
+
+
+def bench_i2v(size: int) -> Dict:
+    """``run_job`` end to end (prepare, denoise, decode, encode) on the tiny pipeline."""
+    import torch
+    from PIL import Image
+    from app.services import i2v_inference
+    from app.services.i2v_worker import Job, NEG_PROMPT_DEFAULT, PROMPT_DEFAULT
+
+    pipe = _tiny_pipeline()
+    i2v_inference.ModelManager._pipe = pipe
+    i2v_inference.ModelManager._unets = {"fp32": pipe.unet}
+    i2v_inference.ModelManager._loaded = True
+    # no tokenizer offline: seed the embedding cache the job will hit
+    for text in (PROMPT_DEFAULT, NEG_PROMPT_DEFAULT):
+        i2v_inference._embed_cache[(text, i2v_inference.BASE_MODEL_ID)] = torch.randn(1, 77, 32)
+
+    side = min(size, 128)
+    steps = 4
+    timings: List[Dict] = []
+
+    def report(**fields):
+        if "timing" in fields:
+            timings.append(fields["timing"])
+
+    with tempfile.TemporaryDirectory() as tmp:
+        Image.fromarray(synthetic_render(size)).save(Path(tmp) / "input.png")
+        job = Job(
+            id="bench", status="running", created_ts=time.time(), total=steps,
+            params={"frames": 8, "fps": 8, "max_side": side, "steps": steps, "denoise_strength": 1.0,
+                    "cfg": 1.0, "seed": 0, "mode": "fp32", "encode_profile": "fast-preview"},
+            job_dir=tmp, input_path=str(Path(tmp) / "input.png"), video_path=str(Path(tmp) / "out.mp4"),
+        )
+        t0 = time.perf_counter()
+        i2v_inference.run_job(job, report)
+        total_ms = (time.perf_counter() - t0) * 1000.0
+    if not timings:
+        raise RuntimeError("run_job reported no step timing")
+    step_ms = timings[-1]["step_s"] * 1000.0
+    return {"ms": total_ms / job.params["frames"], "step_ms": step_ms, "job_ms": total_ms}
+
+
+CASES: Dict[str, Callable[[int], Dict]] = {
+    "mask": bench_mask,
+    "sky": bench_sky,
+    "light": bench_light,
+    "resize": bench_resize,
+    "encode": bench_encode,
+    "i2v": bench_i2v,
+}
+
+
+def run_case(name: str, size: int) -> Dict:
+    """Pool entry point: one case in a fresh process so peak RSS is the case's own."""
+    try:
+        metrics = CASES[name](size)
+    except Exception as e:
+        return {"error": f"{type(e).__name__}: {e}"}
+    metrics["peak_rss_mb"] = _peak_rss_mb()
+    return metrics
@@ -0,0 +1,5 @@
+import os
+import tempfile
+
+# keep job folders and the job database out of app/data while testing
+os.environ.setdefault("DATA_DIR", tempfile.mkdtemp(prefix="i2v-tests-"))
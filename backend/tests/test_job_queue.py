@@ -0,0 +1,153 @@
+"""Dispatcher behaviour of ``JobQueue`` with in-process fake workers."""
+import queue
+import threading
+import time
+
+import pytest
+
+from app.services import i2v_worker
+from app.services.cost_model import CostModel
+from app.services.i2v_worker import Job, JobQueue
+from app.services.job_store import JobStore
+
+
+class _Proc:
+    pid = 0
+
+    def is_alive(self):
+        return True
+
+
+@pytest.fixture
+def jobs(tmp_path, monkeypatch):
+    monkeypatch.setattr(i2v_worker, "I2V_MAX_BATCH", 1)
+    q = JobQueue(workers=1)
+    q._store = JobStore(tmp_path / "jobs.sqlite3", Job)
+    q._cost = CostModel(tmp_path / "cost_model.json")
+    q._started = True  # no worker processes; the test plays the worker
+    for slot in q.slots:
+        slot.proc, slot.tasks, slot.control = _Proc(), queue.Queue(), queue.Queue()
+    threading.Thread(target=q._loop, daemon=True).start()
+    return q
+
+
+def _job(q: JobQueue, tmp_path, name: str, priority: int = 0) -> Job:
+    job = Job(id=name, status="queued", created_ts=time.time(), total=4, priority=priority,
+              params={"frames": 8, "max_side": 256, "steps": 4, "denoise_strength": 0.5, "mode": "fp32"},
+              job_dir=str(tmp_path))
+    q.put(job)
+    return job
+
+
+def _busy(q: JobQueue, running: Job) -> None:
+    slot = q.slots[0]
+    running.status = "running"
+    slot.ready, slot.job_ids = False, [running.id]
+
+
+def _free(q: JobQueue) -> None:
+    slot = q.slots[0]
+    slot.ready, slot.job_ids = True, []
+    q.idle.put(slot.idx)
+
+
+def _dispatched(q: JobQueue) -> list:
+    return [j.id for j in q.slots[0].tasks.get(timeout=5)]
+
+
+def test_higher_priority_job_arriving_later_runs_first(jobs, tmp_path):
+    _busy(jobs, _job(jobs, tmp_path, "running"))
+    _job(jobs, tmp_path, "low", priority=0)
+    time.sleep(0.1)  # the dispatcher is now waiting for a worker
+    _job(jobs, tmp_path, "high", priority=5)
+    _free(jobs)
+    assert _dispatched(jobs) == ["high"]
+
+
+def test_fifo_within_a_priority(jobs, tmp_path):
+    _busy(jobs, _job(jobs, tmp_path, "running"))
+    _job(jobs, tmp_path, "first")
+    _job(jobs, tmp_path, "second")
+    _free(jobs)
+    assert _dispatched(jobs) == ["first"]
+
+
+def test_enqueue_preempts_lower_priority_batch(jobs, tmp_path, monkeypatch):
+    monkeypatch.setattr(i2v_worker, "I2V_PREEMPT", True)
+    _busy(jobs, _job(jobs, tmp_path, "running", priority=0))
+    _job(jobs, tmp_path, "urgent", priority=5)
+    assert jobs.slots[0].control.get(timeout=5) == ("preempt", "running")
+
+
+def test_no_preemption_for_equal_priority_or_free_worker(jobs, tmp_path, monkeypatch):
+    monkeypatch.setattr(i2v_worker, "I2V_PREEMPT", True)
+    _free(jobs)
+    _job(jobs, tmp_path, "a", priority=5)
+    assert _dispatched(jobs) == ["a"]
+    _busy(jobs, jobs.jobs["a"])
+    _job(jobs, tmp_path, "b", priority=5)
+    time.sleep(0.1)
+    assert jobs.slots[0].control.empty()
+
+
+def test_cancel_while_waiting_for_a_worker(jobs, tmp_path):
+    _busy(jobs, _job(jobs, tmp_path, "running"))
+    gone = _job(jobs, tmp_path, "gone")
+    _job(jobs, tmp_path, "kept")
+    time.sleep(0.1)
+    assert jobs.cancel("gone").status == "cancelled"
+    _free(jobs)
+    assert _dispatched(jobs) == ["kept"]
+    assert gone.status == "cancelled"
+
+
+def test_shared_job_is_cancelled_by_its_last_requester(jobs, tmp_path):
+    _busy(jobs, _job(jobs, tmp_path, "running"))
+    shared = jobs.attach(_job(jobs, tmp_path, "shared"))
+    assert shared.requesters == 2
+    assert jobs.cancel("shared").status == "queued"
+    assert jobs.store.get("shared").requesters == 1
+    assert jobs.cancel("shared").status == "cancelled"
+
+
+def test_attach_raises_priority_of_a_queued_job(jobs, tmp_path, monkeypatch):
+    monkeypatch.setattr(i2v_worker, "I2V_PREEMPT", True)
+    _busy(jobs, _job(jobs, tmp_path, "running", priority=3))
+    _job(jobs, tmp_path, "other", priority=2)
+    shared = jobs.attach(_job(jobs, tmp_path, "shared", priority=0), priority=5)
+    assert shared.priority == 5
+    assert jobs.slots[0].control.get(timeout=5) == ("preempt", "running")
+    _free(jobs)
+    assert _dispatched(jobs) == ["shared"]
+
+
+def test_lone_batchable_job_skips_the_batch_window(jobs, tmp_path, monkeypatch):
+    monkeypatch.setattr(i2v_worker, "I2V_MAX_BATCH", 4)
+    monkeypatch.setattr(i2v_worker, "I2V_BATCH_WINDOW_S", 30.0)
+    _busy(jobs, _job(jobs, tmp_path, "running"))
+    lone = Job(id="lone", status="queued", created_ts=time.time(), total=4, batch_key="k",
+               params={"frames": 8, "max_side": 256, "steps": 4, "denoise_strength": 0.5, "mode": "fp32"},
+               job_dir=str(tmp_path))
+    jobs.put(lone)
+    _free(jobs)
+    assert _dispatched(jobs) == ["lone"]
+
+
+def test_preempt_after_cancel_does_not_requeue(jobs, tmp_path, monkeypatch):
+    monkeypatch.setattr(i2v_worker, "I2V_PREEMPT", True)
+    jobs._events = queue.Queue()
+    threading.Thread(target=jobs._collect, daemon=True).start()
+    _busy(jobs, _job(jobs, tmp_path, "doomed"))
+    assert jobs.cancel("doomed").status == "cancelling"
+    assert jobs.slots[0].control.get(timeout=5) == ("cancel", "doomed")
+    _job(jobs, tmp_path, "urgent", priority=5)
+    time.sleep(0.1)
+    assert jobs.slots[0].control.empty()
+    # a preempt that raced the cancel still reports the job as re-queued
+    jobs._events.put((0, "doomed", {"status": "queued", "started_ts": None, "current": 0}))
+    deadline = time.time() + 5
+    while jobs.store.get("doomed").status != "cancelled" and time.time() < deadline:
+        time.sleep(0.02)
+    assert jobs.store.get("doomed").status == "cancelled"
+    _free(jobs)
+    assert _dispatched(jobs) == ["urgent"]